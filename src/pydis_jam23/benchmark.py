@@ -0,0 +1,303 @@
+"""An offline benchmark of every codec, on synthetic covers.
+
+Each case (a codec, cover size and mode, and payload size) is run in a fresh
+worker process, so its peak memory use can be measured on its own. Results
+are written as JSON, which can be passed back in with ``--compare`` to see
+how a later run differs.
+
+    python -m pydis_jam23.benchmark --sizes 0.3 4 -o results.json
+"""
+import argparse
+import json
+import platform
+import resource
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from .codecs import CODECS, Codec, CodecError, edges
+
+DEFAULT_SIZES = [0.3, 4, 24, 100]
+DEFAULT_MODES = ["RGB", "RGBA"]
+DEFAULT_PAYLOADS = [2**10, 2**16, 2**20]
+PASSWORD = "benchmark"
+MB = 2**20
+
+
+@dataclass(frozen=True)
+class Case:
+    codec: str
+    megapixels: float
+    mode: str
+    payload: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.codec}/{self.megapixels}MP/{self.mode}/{self.payload}B"
+
+
+@dataclass
+class Timing:
+    seconds: list[float]
+    mb_per_second: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    traced_peak_mb: float
+
+    @classmethod
+    def from_samples(cls, seconds: list[float], payload: int, traced_peak: int) -> "Timing":
+        p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+        return cls(
+            seconds=seconds,
+            mb_per_second=payload / MB / float(np.median(seconds)),
+            p50_ms=float(p50),
+            p90_ms=float(p90),
+            p99_ms=float(p99),
+            traced_peak_mb=traced_peak / MB,
+        )
+
+
+@dataclass
+class Result:
+    case: Case
+    status: str
+    error: str | None = None
+    encode: Timing | None = None
+    decode: Timing | None = None
+    cover_rss_mb: float | None = None
+    peak_rss_mb: float | None = None
+    extra: dict[str, typing.Any] = field(default_factory=dict)
+
+
+def run():
+    args = build_arg_parser().parse_args()
+    codecs = [codec for codec in CODECS if not args.codecs or codec.short_name in args.codecs]
+    cases = [
+        Case(codec.short_name, megapixels, mode, payload)
+        for megapixels in args.sizes
+        for mode in args.modes
+        for codec in codecs
+        for payload in args.payloads
+    ]
+    results = run_cases(cases, args.repeat, lambda result: print(summarise(result), file=sys.stderr))
+    report = {"environment": environment(), "repeat": args.repeat, "results": [asdict(result) for result in results]}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        for line in compare(baseline, report):
+            print(line, file=sys.stderr)
+    return 1 if any(result.status == "error" for result in results) else 0
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the codecs on synthetic covers.")
+    parser.add_argument(
+        "--sizes",
+        metavar="MP",
+        type=float,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="cover sizes in megapixels",
+    )
+    parser.add_argument("--modes", nargs="+", choices=["RGB", "RGBA"], default=DEFAULT_MODES, help="cover modes")
+    parser.add_argument(
+        "--payloads",
+        metavar="BYTES",
+        type=int,
+        nargs="+",
+        default=DEFAULT_PAYLOADS,
+        help="message sizes, skipped where they don't fit a cover",
+    )
+    parser.add_argument(
+        "--codecs",
+        metavar="NAME",
+        nargs="+",
+        choices=[codec.short_name for codec in CODECS],
+        help="the codecs to run (default: all)",
+    )
+    parser.add_argument("--repeat", metavar="N", type=int, default=5, help="timed calls per operation")
+    parser.add_argument("-o", "--output", metavar="FILE", help="where to write the JSON results (default: stdout)")
+    parser.add_argument("--compare", metavar="FILE", help="earlier JSON results to compare against")
+    return parser
+
+
+def run_cases(cases: list[Case], repeat: int, on_result: Callable[[Result], None]) -> list[Result]:
+    """Run each case in a fresh worker process, so the peak memory of each is measured separately."""
+    results = []
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as pool:
+        for case in cases:
+            result = pool.submit(run_case, case, repeat).result()
+            on_result(result)
+            results.append(result)
+    return results
+
+
+def run_case(case: Case, repeat: int) -> Result:
+    """Time encoding and decoding a message for a case, in a worker process."""
+    codec = next(codec for codec in CODECS if codec.short_name == case.codec)
+    cover = make_cover(case.megapixels, case.mode)
+    message = make_payload(case.payload)
+    encode_args = codec_args(codec, codec.encode_params)
+    decode_args = codec_args(codec, codec.decode_params)
+    result = Result(case=case, status="ok", cover_rss_mb=peak_rss_mb())
+    try:
+        capacity = codec.capacity(cover, **encode_args)
+        if capacity is not None and case.payload > capacity:
+            result.status = "skipped"
+            result.error = f"payload doesn't fit, capacity is {capacity} bytes"
+            return result
+        encoded, result.encode = time_calls(
+            lambda _: codec.encode(cover, message, **encode_args), cold(lambda: None), case.payload, repeat
+        )
+        encoded.load()
+        # some decoders draw on the image they are given, so each gets its own copy
+        decoded, result.decode = time_calls(
+            lambda image: codec.decode(image, **decode_args), cold(encoded.copy), case.payload, repeat
+        )
+        result.extra["roundtrip"] = decoded == message
+    except (CodecError, MemoryError, ValueError) as e:
+        result.status = "error"
+        result.error = f"{type(e).__name__}: {e}"
+    result.peak_rss_mb = peak_rss_mb()
+    return result
+
+
+T = typing.TypeVar("T")
+S = typing.TypeVar("S")
+
+
+def time_calls(call: Callable[[S], T], setup: Callable[[], S], payload: int, repeat: int) -> tuple[T, Timing]:
+    """Time some calls to a function, then trace one more to find its peak allocations.
+
+    The argument for each call is made by ``setup``, which isn't timed.
+    """
+    seconds = []
+    for _ in range(max(1, repeat)):
+        argument = setup()
+        start = time.perf_counter()
+        value = call(argument)
+        seconds.append(time.perf_counter() - start)
+    # tracing slows allocations down, so it is kept out of the timed calls
+    argument = setup()
+    tracemalloc.start()
+    try:
+        call(argument)
+        _, traced_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, Timing.from_samples(seconds, payload, traced_peak)
+
+
+def cold(setup: Callable[[], S]) -> Callable[[], S]:
+    """Empty the codecs' caches before each call, as well as setting it up, so the work they save is timed too."""
+
+    def cold_setup() -> S:
+        edges.mask_cache.clear()
+        return setup()
+
+    return cold_setup
+
+
+def make_cover(megapixels: float, mode: str, seed: int = 0) -> Image.Image:
+    """Generate a cover with smooth gradients, some shapes and a little noise, like a photo might have."""
+    pixels = round(megapixels * 1_000_000)
+    width = max(1, round((pixels * 4 / 3) ** 0.5))
+    height = max(1, pixels // width)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    bands = len(mode)
+    data = np.empty((height, width, bands), dtype=np.uint8)
+    for band in range(bands):
+        gradient = (x * (band + 1) / bands + y * (bands - band) / bands) / 2
+        # blocky shapes give the edge detection something to find
+        blocks = ((x // 64 + y // 48 + band) % 3 == 0) * 64
+        noise = rng.integers(-8, 9, (height, width), dtype=np.int16)
+        data[..., band] = np.clip(gradient + blocks + noise, 0, 255)
+    return Image.fromarray(data, mode)
+
+
+def make_payload(size: int, seed: int = 0) -> bytes:
+    """Generate a printable message, as some codecs render the message as text."""
+    alphabet = np.frombuffer((string.ascii_letters + string.digits + " ").encode(), dtype=np.uint8)
+    return np.random.default_rng(seed).choice(alphabet, size).tobytes()
+
+
+def codec_args(codec: Codec, extra_params: list) -> dict[str, typing.Any]:
+    """Use each parameter's default, with a fixed password for those needing one."""
+    args = {}
+    for param in codec.params + extra_params:
+        args[param.name] = PASSWORD if param.required and param.type_ is str else param.default
+    return args
+
+
+def peak_rss_mb() -> float:
+    """The peak resident memory of this process so far (kilobytes on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / MB if sys.platform == "darwin" else peak / 1024
+
+
+def environment() -> dict[str, str | None]:
+    """Describe where the benchmark ran, so results can be matched up with commits and machines."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True  # noqa: S603, S607
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now(tz=UTC).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+    }
+
+
+def summarise(result: Result) -> str:
+    """Describe a result in a line, for following along."""
+    if result.encode is None or result.decode is None:
+        return f"{result.case.name}: {result.status} ({result.error})"
+    return (
+        f"{result.case.name}: encode {result.encode.mb_per_second:.2f} MB/s (p50 {result.encode.p50_ms:.1f} ms),"
+        f" decode {result.decode.mb_per_second:.2f} MB/s (p50 {result.decode.p50_ms:.1f} ms),"
+        f" peak RSS {result.peak_rss_mb:.0f} MB"
+    )
+
+
+def compare(baseline: dict, report: dict) -> list[str]:
+    """Compare the median latencies of the cases two reports have in common."""
+    lines = [f"Compared to {baseline['environment']['commit'] or 'baseline'} (new / old median time):"]
+    old_results = {Case(**result["case"]): result for result in baseline["results"]}
+    for result in report["results"]:
+        old = old_results.get(Case(**result["case"]))
+        if old is None or result["status"] != "ok" or old["status"] != "ok":
+            continue
+        ratios = [
+            float(np.median(result[op]["seconds"]) / np.median(old[op]["seconds"])) for op in ("encode", "decode")
+        ]
+        lines.append(f"{Case(**result['case']).name}: encode {ratios[0]:.2f}x, decode {ratios[1]:.2f}x")
+    return lines
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,41 +1,114 @@
 import argparse
+import functools
+import json
+import os
+import pathlib
+import shlex
+import stat
 import sys
+import time
 import typing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 
 from PIL import Image
 
-from .codecs import CODECS, Codec, CodecError, CodecParam
+from .codecs import CODECS, Codec, CodecError, CodecParam, FileCodec, StreamCodec, detect, lsb, shard
+from .codecs.trace import span, tracing
+from .output import DEFAULT_COMPRESS_LEVEL, FORMATS, OutputOptions, save_image
+
+STREAM_CHUNK_SIZE = 2**16
 
 
 def run():
-    args = build_arg_parser().parse_args()
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.detect:
+        return run_detect(args)
+    if args.codec is None:
+        parser.error(f"one of the arguments {' '.join(codec.cli_flag for codec in CODECS)} is required")
     codec: Codec = args.codec
-    params = codec.params + (codec.encode_params if args.plain else codec.decode_params)
+    encoding = bool(args.plain or args.batch_plain or args.shard_plain or args.capacity)
+    params = codec.params + (codec.encode_params if encoding else codec.decode_params)
+    if args.capacity:
+        # only the size of the image matters, so things like passwords aren't needed
+        params = [param for param in params if not param.required]
     extra_args = find_args(args, codec, params)
+    output = OutputOptions(format_=args.format, compress_level=args.compress_level, optimize=args.optimize)
     try:
-        if args.plain:
-            encode_message(args.plain, codec, extra_args)
-        else:
-            decode_message(args.extract, codec, extra_args)
+        with tracing() as timings:
+            if args.plain:
+                encode_message(args.plain, codec, extra_args, output)
+            elif args.extract:
+                decode_message(args.extract, codec, extra_args)
+            elif args.capacity:
+                return report_capacity(args.capacity, codec, extra_args, args.message_length)
+            elif args.shard_plain:
+                return encode_shards(args.shard_plain, args.output_dir, codec, extra_args, args.jobs, output)
+            elif args.shard_extract:
+                decode_shards(args.shard_extract, codec, extra_args, args.jobs)
+            else:
+                source = args.batch_plain or args.batch_extract
+                items = find_batch_items(source, args.output_dir, encoding, output.format_info.extension)
+                return run_batch(items, codec, extra_args, args.jobs, output)
     except CodecError as e:
         if args.verbose > 0:
             raise
         else:
             print(f"Error: {e}", file=sys.stderr)
         return 1
+    if args.timings_json:
+        print(json.dumps(timings.as_dict()), file=sys.stderr)
+    elif args.verbose > 0:
+        if args.plain and not isinstance(codec, FileCodec):
+            print(f"Saved as {output.describe()}", file=sys.stderr)
+        print(timings.breakdown(), file=sys.stderr)
+    return 0
+
+
+def run_detect(args: argparse.Namespace) -> int:
+    """Decode a message without being told the codec, by detecting it, and write the message to stdout."""
+    try:
+        with tracing() as timings:
+            candidate, message = detect_message(args.detect, args.jobs, args.force)
+            with span("write"):
+                sys.stdout.buffer.write(message)
+    except CodecError as e:
+        if args.verbose > 0:
+            raise
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if candidate.probe.confidence <= detect.LIKELY_CONFIDENCE:
+        print(f"Warning: this may not be a message, the best guess was {candidate.describe()}.", file=sys.stderr)
+    if args.timings_json:
+        print(json.dumps(timings.as_dict()), file=sys.stderr)
+    elif args.verbose > 0:
+        print(f"Decoded with {candidate.describe()}", file=sys.stderr)
+        print(timings.breakdown(), file=sys.stderr)
     return 0
 
 
 def build_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
-    parser.add_argument("-v", "--verbose", action="count", default=0, help="increase output verbosity")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="increase output verbosity, including how long each stage of encoding or decoding took",
+    )
+    parser.add_argument(
+        "--timings-json",
+        action="store_true",
+        help="print how long each stage of encoding or decoding took to stderr as JSON",
+    )
     action = parser.add_mutually_exclusive_group(required=True)
     action.add_argument(
         "-p",
         "--plain",
         metavar="FILE",
         type=argparse.FileType("rb"),
-        help="a plain image to hide a message from stdin in, writes PNG to stdout",
+        help="a plain image to hide a message from stdin in, writes the image to stdout",
     )
     action.add_argument(
         "-x",
@@ -44,7 +117,102 @@ def build_arg_parser() -> argparse.ArgumentParser:
         type=argparse.FileType("rb"),
         help="extract a message from an image to stdout",
     )
-    codec_arg = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument(
+        "-P",
+        "--batch-plain",
+        metavar="PATH",
+        type=pathlib.Path,
+        help=(
+            "hide messages in many images: either a manifest with an image, message file and output"
+            " per line, or a directory of images to hide the message from stdin in"
+        ),
+    )
+    action.add_argument(
+        "-X",
+        "--batch-extract",
+        metavar="PATH",
+        type=pathlib.Path,
+        help="extract messages from many images: either a manifest with an image and output per line, or a directory",
+    )
+    action.add_argument(
+        "-S",
+        "--shard-plain",
+        metavar="FILE",
+        type=pathlib.Path,
+        nargs="+",
+        help="split a message from stdin across several plain images with --lsb, writing them to --output-dir",
+    )
+    action.add_argument(
+        "-U",
+        "--shard-extract",
+        metavar="FILE",
+        type=pathlib.Path,
+        nargs="+",
+        help="put a message back together from all the images it was split across, in any order, to stdout",
+    )
+    action.add_argument(
+        "-d",
+        "--detect",
+        metavar="FILE",
+        type=argparse.FileType("rb"),
+        help="extract a message from an image to stdout, finding which codec hid it without needing a codec flag",
+    )
+    action.add_argument(
+        "-c",
+        "--capacity",
+        metavar="FILE",
+        type=argparse.FileType("rb"),
+        help="print the most bytes that can be hidden in an image, or 'unlimited', without encoding anything",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="with --detect, extract whatever the most likely codec finds, even if it doesn't look like a message",
+    )
+    parser.add_argument(
+        "--message-length",
+        metavar="BYTES",
+        type=int,
+        help="with --capacity, check a message of this length fits, and suggest the fewest LSB bits that fit it",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        metavar="DIR",
+        type=pathlib.Path,
+        default=pathlib.Path(),
+        help="where to write outputs when batch processing a directory, or sharding a message",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes to use for batch processing or sharding",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=FORMATS,
+        default="png",
+        help="the lossless format to write encoded images in, bmp, ppm and tiff are uncompressed (default: png)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        metavar="LEVEL",
+        type=int,
+        choices=range(10),
+        default=DEFAULT_COMPRESS_LEVEL,
+        help=f"PNG zlib compression level, 0 (fastest) to 9 (smallest) (default: {DEFAULT_COMPRESS_LEVEL})",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="spend extra time making PNGs as small as possible",
+    )
+    # required unless detecting the codec, which `run` checks
+    codec_arg = parser.add_mutually_exclusive_group()
     for codec in CODECS:
         codec_arg.add_argument(
             codec.cli_flag,
@@ -96,14 +264,265 @@ def codec_arg_qualname(codec: Codec, param: CodecParam) -> str:
     return f"codec-{codec.short_name}-{param.name}"
 
 
-def encode_message(plain: typing.BinaryIO, codec: Codec, extra_args: dict[str, typing.Any]) -> None:
-    message = sys.stdin.buffer.read()
-    image = Image.open(plain)
-    image = codec.encode(image, message, **extra_args)
-    image.save(sys.stdout.buffer, format="PNG")
+def encode_message(
+    plain: typing.BinaryIO, codec: Codec, extra_args: dict[str, typing.Any], output: OutputOptions
+) -> None:
+    if isinstance(codec, StreamCodec) and not isinstance(codec, FileCodec):
+        chunks = iter(lambda: sys.stdin.buffer.read(STREAM_CHUNK_SIZE), b"")
+        with span("open"):
+            image = Image.open(plain)
+        image = codec.encode_stream(image, chunks, stream_length(sys.stdin.buffer), **extra_args)
+        save_image(image, sys.stdout.buffer, output)
+        return
+    with span("read"):
+        message = sys.stdin.buffer.read()
+    write_encoded(plain, sys.stdout.buffer, message, codec, extra_args, output)
 
 
 def decode_message(extract: typing.BinaryIO, codec: Codec, extra_args: dict[str, typing.Any]) -> None:
-    image = Image.open(extract)
-    message = codec.decode(image, **extra_args)
-    sys.stdout.buffer.write(message)
+    if isinstance(codec, StreamCodec) and not isinstance(codec, FileCodec):
+        with span("open"):
+            image = Image.open(extract)
+        for chunk in codec.decode_stream(image, **extra_args):
+            with span("write"):
+                sys.stdout.buffer.write(chunk)
+        return
+    message = read_decoded(extract, codec, extra_args)
+    with span("write"):
+        sys.stdout.buffer.write(message)
+
+
+def detect_message(extract: typing.BinaryIO, jobs: int | None, force: bool) -> tuple[detect.Candidate, bytes]:
+    """Decode a message with whichever codec most likely hid it, returning the candidate used and the message."""
+    return detect.decode(open_image(extract), jobs, force=force)
+
+
+def report_capacity(
+    image_file: typing.BinaryIO, codec: Codec, extra_args: dict[str, typing.Any], message_length: int | None
+) -> int:
+    """Print how much an image can hold, returning an exit status of 1 if a message of the given length won't fit."""
+    image = Image.open(image_file)  # only the header is read
+    capacity = codec.capacity(image, **extra_args)
+    print("unlimited" if capacity is None else capacity)
+    if message_length is None:
+        return 0
+    if codec is lsb:
+        bits = lsb.recommend_bits(image, message_length)
+        if bits is None:
+            print(f"A message of {message_length} bytes doesn't fit with any number of bits.", file=sys.stderr)
+        else:
+            print(f"Use {lsb.cli_flag}-bits {bits} to fit a message of {message_length} bytes.", file=sys.stderr)
+    if capacity is not None and message_length > capacity:
+        print(f"A message of {message_length} bytes doesn't fit.", file=sys.stderr)
+        return 1
+    return 0
+
+
+def stream_length(stream: typing.BinaryIO) -> int | None:
+    """Find the number of bytes left in a stream, if it is a regular file rather than a pipe."""
+    try:
+        info = os.fstat(stream.fileno())
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        return info.st_size - stream.tell()
+    except (OSError, ValueError):
+        return None
+
+
+def write_encoded(
+    plain: typing.BinaryIO,
+    target: typing.BinaryIO,
+    message: bytes,
+    codec: Codec,
+    extra_args: dict[str, typing.Any],
+    output: OutputOptions,
+) -> None:
+    """Encode a message into an image.
+
+    Codecs which work on files write their own output, saving any image they
+    make with the output options, though a file passed through unchanged (as
+    concat does in trailer mode) keeps its own format.
+    """
+    if isinstance(codec, FileCodec):
+        codec.encode_file(plain, target, message, save=functools.partial(save_image, options=output), **extra_args)
+        return
+    image = open_image(plain)
+    image = codec.encode(image, message, **extra_args)
+    save_image(image, target, output)
+
+
+def read_decoded(extract: typing.BinaryIO, codec: Codec, extra_args: dict[str, typing.Any]) -> bytes:
+    if isinstance(codec, FileCodec):
+        return codec.decode_file(extract, **extra_args)
+    return codec.decode(open_image(extract), **extra_args)
+
+
+def open_image(file: typing.BinaryIO) -> Image.Image:
+    """Open and decode an image, timing each separately."""
+    with span("open"):
+        image = Image.open(file)
+    with span("load"):
+        image.load()
+    return image
+
+
+def encode_shards(
+    covers: list[pathlib.Path],
+    output_dir: pathlib.Path,
+    codec: Codec,
+    extra_args: dict[str, typing.Any],
+    jobs: int,
+    output: OutputOptions,
+) -> int:
+    """Split a message from stdin into shards, encoding one into each cover as a batch."""
+    check_shard_codec(codec)
+    capacities = []
+    for cover in covers:
+        try:
+            with Image.open(cover) as image:  # only the header is read
+                capacities.append(lsb.capacity(image, **extra_args))
+        except OSError as e:
+            msg = f"{cover}: {e}"
+            raise CodecError(msg) from e
+    with span("read"):
+        message = sys.stdin.buffer.read()
+    shards = shard.split(message, capacities)
+    items = [
+        BatchItem(image=cover, output=output_dir / (cover.stem + output.format_info.extension), message=data)
+        for cover, data in zip(covers, shards, strict=True)
+    ]
+    if len({item.output for item in items}) < len(items):
+        msg = "The images need different names, as the encoded images are named after them."
+        raise CodecError(msg)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return run_batch(items, codec, extra_args, jobs, output)
+
+
+def decode_shards(images: list[pathlib.Path], codec: Codec, extra_args: dict[str, typing.Any], jobs: int) -> None:
+    """Decode the shards of a message across a pool of worker processes, and write the message to stdout."""
+    check_shard_codec(codec)
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        shards = list(pool.map(read_shard, images, [extra_args] * len(images)))
+    message = shard.join(shards)
+    with span("write"):
+        sys.stdout.buffer.write(message)
+
+
+def read_shard(image: pathlib.Path, extra_args: dict[str, typing.Any]) -> bytes:
+    """Decode the shard in an image, in a worker process."""
+    try:
+        with image.open("rb") as file:
+            return read_decoded(file, lsb, extra_args)
+    except (CodecError, OSError) as e:
+        msg = f"{image}: {e}"
+        raise CodecError(msg) from e
+
+
+def check_shard_codec(codec: Codec) -> None:
+    if codec is not lsb:
+        msg = f"Messages can only be sharded with {lsb.cli_flag}, not {codec.cli_flag}."
+        raise CodecError(msg)
+
+
+@dataclass
+class BatchItem:
+    image: pathlib.Path
+    output: pathlib.Path
+    message: pathlib.Path | bytes | None = None
+
+
+@dataclass
+class BatchResult:
+    item: BatchItem
+    size: int
+    error: str | None
+
+
+def find_batch_items(
+    source: pathlib.Path, output_dir: pathlib.Path, encoding: bool, extension: str = ".png"
+) -> list[BatchItem]:
+    """Find the items to process from a manifest or a directory of images."""
+    if not source.is_dir():
+        return read_manifest(source, encoding)
+    message = sys.stdin.buffer.read() if encoding else None
+    suffix = extension if encoding else ".bin"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return [
+        BatchItem(image=image, output=output_dir / (image.stem + suffix), message=message)
+        for image in sorted(source.iterdir())
+        if image.is_file()
+    ]
+
+
+def read_manifest(manifest: pathlib.Path, encoding: bool) -> list[BatchItem]:
+    """Read a manifest of ``image message output`` (or ``image output``) lines, allowing shell style quoting."""
+    items = []
+    for line_number, line in enumerate(manifest.read_text().splitlines(), start=1):
+        fields = shlex.split(line, comments=True)
+        if not fields:
+            continue
+        if len(fields) != (3 if encoding else 2):
+            msg = (
+                f"{manifest}:{line_number}: expected {'image, message and output' if encoding else 'image and output'}"
+            )
+            raise CodecError(msg)
+        paths = [manifest.parent / field for field in fields]
+        if encoding:
+            items.append(BatchItem(image=paths[0], message=paths[1], output=paths[2]))
+        else:
+            items.append(BatchItem(image=paths[0], output=paths[1]))
+    return items
+
+
+def run_batch(
+    items: list[BatchItem],
+    codec: Codec,
+    extra_args: dict[str, typing.Any],
+    jobs: int,
+    output: OutputOptions = OutputOptions(),  # noqa: B008 - immutable
+) -> int:
+    """Process a batch of items across a pool of worker processes, and print a summary to stderr."""
+    start = time.perf_counter()
+    failures = []
+    total_size = 0
+    with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+        tasks = [pool.submit(process_batch_item, item, codec.short_name, extra_args, output) for item in items]
+        for task in tasks:
+            result = task.result()
+            total_size += result.size
+            if result.error is not None:
+                failures.append(result)
+                print(f"{result.item.image}: {result.error}", file=sys.stderr)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"Processed {len(items)} images ({len(items) - len(failures)} succeeded, {len(failures)} failed)"
+        f" in {elapsed:.2f}s: {len(items) / elapsed:.1f} images/s, {total_size / elapsed / 1e6:.1f} MB/s",
+        file=sys.stderr,
+    )
+    return 1 if failures else 0
+
+
+def process_batch_item(
+    item: BatchItem, codec_name: str, extra_args: dict[str, typing.Any], output: OutputOptions
+) -> BatchResult:
+    """Encode or decode a single batch item, in a worker process."""
+    codec = next(codec for codec in CODECS if codec.short_name == codec_name)
+    size = 0
+    try:
+        size += item.image.stat().st_size
+        with item.image.open("rb") as image, item.output.open("wb") as target:
+            if item.message is None:
+                message = read_decoded(image, codec, extra_args)
+                target.write(message)
+            else:
+                message = item.message if isinstance(item.message, bytes) else item.message.read_bytes()
+                write_encoded(image, target, message, codec, extra_args, output)
+            size += len(message)
+    except (CodecError, OSError, ValueError) as e:
+        item.output.unlink(missing_ok=True)
+        return BatchResult(item=item, size=size, error=str(e) or type(e).__name__)
+    except Exception as e:
+        # anything else going wrong with one item is reported along with it too, rather than stopping the batch
+        item.output.unlink(missing_ok=True)
+        return BatchResult(item=item, size=size, error=f"{type(e).__name__}: {e}")
+    return BatchResult(item=item, size=size, error=None)
@@ -1,10 +1,12 @@
-from typing import Any, Protocol
+from collections.abc import Iterable, Iterator
+from typing import Any, BinaryIO, Protocol, runtime_checkable
 
+import numpy as np
 from PIL import Image
 
 from . import concat, edges, lsb, noise, notlsb, ssdb
 
-from .common import CodecError, CodecParam
+from .common import CodecError, CodecParam, Probe, SaveImage
 
 
 class Codec(Protocol):
@@ -24,7 +26,79 @@ class Codec(Protocol):
     def decode(self, image: Image.Image, **decode_args: Any) -> bytes:
         ...
 
+    def capacity(self, image: Image.Image, **codec_args: Any) -> int | None:
+        """Find the length of the longest message that can be encoded into an image, or None if unlimited.
+
+        This takes the same arguments as `encode`, and doesn't embed anything.
+        """
+        ...
+
+    def probe(self, image: Image.Image) -> Probe:
+        """Guess how likely an image is to hold a message from this codec, and the arguments to decode it with.
+
+        Only a small part of the start of the image is looked at, so this is
+        fast enough to try every codec, though it is only a guess. Arguments
+        which can't be guessed, like passwords, make a codec undetectable.
+        """
+        ...
+
+
+@runtime_checkable
+class FileCodec(Codec, Protocol):
+    """A codec which can also work directly on image files.
+
+    Where a codec provides these, they are used in preference to `encode` and
+    `decode` by the CLI, which lets a codec avoid decoding the pixels at all.
+    Any image the codec makes is saved with ``save``, so the caller can choose
+    its format, rather than the codec writing it out itself.
+    """
+
+    def encode_file(
+        self, source: BinaryIO, target: BinaryIO, message: bytes, *, save: SaveImage = ..., **encode_args: Any
+    ) -> None:
+        ...
+
+    def decode_file(self, source: BinaryIO, **decode_args: Any) -> bytes:
+        ...
+
+
+@runtime_checkable
+class ArrayCodec(Codec, Protocol):
+    """A codec which can work directly on an array of pixels.
+
+    The array holds the image's raw bytes, shaped ``(height, width, bands)``
+    for 8 bit modes (see `common.image_to_array`). Encoding returns a new
+    array, unless ``in_place`` is given, in which case the (writable,
+    contiguous) array passed in is modified and returned where possible.
+    `encode` and `decode` are thin wrappers around these.
+    """
+
+    def encode_array(
+        self, pixels: np.ndarray, mode: str, message: bytes, *, in_place: bool = False, **encode_args: Any
+    ) -> np.ndarray:
+        ...
+
+    def decode_array(self, pixels: np.ndarray, mode: str, **decode_args: Any) -> bytes:
+        ...
+
+
+@runtime_checkable
+class StreamCodec(Codec, Protocol):
+    """A codec which can take and give messages in chunks, to keep memory use bounded for big messages.
+
+    If ``length`` isn't given, the codec must work out where the message ends
+    itself, for example by reserving space for a length header.
+    """
+
+    def encode_stream(
+        self, image: Image.Image, chunks: Iterable[bytes], length: int | None = None, **encode_args: Any
+    ) -> Image.Image:
+        ...
+
+    def decode_stream(self, image: Image.Image, **decode_args: Any) -> Iterator[bytes]:
+        ...
+
 
 CODECS: list[Codec] = [lsb, edges, noise, notlsb, ssdb, concat]
 
-__all__ = ["CodecError", "CODECS", "Codec"]
+__all__ = ["CodecError", "CODECS", "ArrayCodec", "Codec", "FileCodec", "Probe", "StreamCodec"]
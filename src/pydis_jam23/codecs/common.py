@@ -1,6 +1,16 @@
+import codecs
+import contextvars
+import operator
 import pathlib
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, TypeVar
+
+import numpy as np
+from PIL import Image, ImageMode
+
+from .trace import span
 
 
 class CodecError(Exception):
@@ -19,19 +29,38 @@ class CodecParam:
     cli_flag: str
 
 
+@dataclass(frozen=True)
+class Probe:
+    """How likely an image is to hold a message from a codec, from 0 to 1, and the arguments to decode it with."""
+
+    confidence: float
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# evidence needed for a sample to be as likely text as random, see `text_confidence`
+TEXT_PRIOR_BITS = 3
+# how a codec working on files should save the images it makes
+SaveImage = Callable[[Image.Image, BinaryIO], object]
+
 ASSETS = pathlib.Path(__file__).parent.parent / "assets"
 SEVEN_BIT_MAX = 127
 
 
-def encode_varint(value: int) -> bytes:
+def encode_varint(value: int, min_length: int = 1) -> bytes:
     """Encode an integer using a variable length encoding.
 
     Specifically, the most significant bit of each byte is used to indicate
     whether or not it is the last byte in the encoding. The remaining seven
     bits are used to store the value, in little-endian order.
+
+    The encoding can be padded out to ``min_length`` bytes, which still
+    decodes to the same value. This allows space to be reserved for it.
     """
     encoded = bytearray()
-    while value > SEVEN_BIT_MAX:
+    while value > SEVEN_BIT_MAX or len(encoded) + 1 < min_length:
         encoded.append(0b1000_0000 | (value & 0b0111_1111))
         value >>= 7
     encoded.append(value)
@@ -49,3 +78,171 @@ def decode_varint(read_byte: Callable[[], int]) -> int:
             break
         shift += 7
     return value
+
+
+def max_message_length(space: int) -> int:
+    """Find the longest message which fits in a number of bytes along with its varint length prefix."""
+    length = max(0, space - 1)
+    while length and len(encode_varint(length)) + length > space:
+        length -= 1
+    return length
+
+
+def raw_row_size(mode: str, width: int) -> int:
+    """Find the number of raw bytes in one row of an image, as ``tobytes()`` would give them.
+
+    This only needs the image's header, so the pixels are never decoded.
+    """
+    if mode == "1":
+        return -(-width // 8)
+    mode_info = ImageMode.getmode(mode)
+    item_size = np.dtype(mode_info.typestr).itemsize
+    return width * item_size * len(mode_info.bands)
+
+
+def raw_size(image: Image.Image) -> int:
+    """Find the total number of raw bytes in an image, without decoding it."""
+    return raw_row_size(image.mode, image.width) * image.height
+
+
+def image_to_array(image: Image.Image, *, writable: bool = True) -> np.ndarray:
+    """Copy the raw pixel data of an image into an array.
+
+    8 bit modes give a ``(height, width, bands)`` array (or ``(height, width)``
+    for a single band), like ``numpy.asarray`` would. Other modes give one row
+    of raw bytes per line of pixels. Either way, the array's bytes are exactly
+    those of ``image.tobytes()``, so it can be turned back into an image with
+    ``Image.frombytes(image.mode, image.size, array)``.
+
+    If the array doesn't need to be writable, this saves a copy.
+    """
+    with span("tobytes"):
+        raw = image.tobytes()
+    data = np.frombuffer(bytearray(raw) if writable else raw, dtype=np.uint8)
+    bands = len(image.getbands())
+    if len(data) != image.width * image.height * bands:
+        return data.reshape(image.height, -1)
+    if bands == 1:
+        return data.reshape(image.height, image.width)
+    return data.reshape(image.height, image.width, bands)
+
+
+def prepare_pixels(pixels: np.ndarray, in_place: bool) -> np.ndarray:
+    """Get the pixel array an array codec should write to.
+
+    Unless working in place this is a copy, so the caller's array is left alone.
+    """
+    if not in_place:
+        with span("copy"):
+            return np.array(pixels, dtype=np.uint8, order="C")
+    if pixels.dtype != np.uint8 or not pixels.flags.c_contiguous or not pixels.flags.writeable:
+        msg = "Encoding in place needs a writable, contiguous array of bytes."
+        raise ValueError(msg)
+    return pixels
+
+
+def array_to_image(pixels: np.ndarray, mode: str, size: tuple[int, int]) -> Image.Image:
+    """Turn an array from `image_to_array` back into an image."""
+    with span("frombytes"):
+        return Image.frombytes(mode, size, pixels)
+
+
+def flat_pixels(pixels: np.ndarray) -> np.ndarray:
+    """View the raw bytes of a pixel array as a flat array, as ``tobytes()`` would give them."""
+    return np.ascontiguousarray(pixels, dtype=np.uint8).reshape(-1)
+
+
+class ImageRows:
+    """Lazily materialised raw bytes from bands of rows of an image.
+
+    Rather than calling ``tobytes()`` on the whole image, just the rows
+    holding a range of bytes are cropped out when they are needed, and
+    nothing is kept between reads.
+    """
+
+    def __init__(self, image: Image.Image):
+        self.image = image
+        self.row_size = raw_row_size(image.mode, image.width)
+
+    def __len__(self) -> int:
+        """The total number of raw bytes in the image."""
+        return self.row_size * self.image.height
+
+    def read(self, start: int, end: int) -> tuple[bytes, int]:
+        """Get the raw bytes of the rows covering ``start:end``, and the index of the first byte returned."""
+        first_row = start // self.row_size
+        end_row = min(self.image.height, -(-end // self.row_size))
+        return self.image.crop((0, first_row, self.image.width, end_row)).tobytes(), first_row * self.row_size
+
+
+def map_threads(function: Callable[[T], R], items: Iterable[T], workers: int | None = None) -> list[R]:
+    """Call a function on each item in a pool of threads, returning the results in order.
+
+    numpy and Pillow release the GIL for their heavy lifting, so codecs can
+    run on several images at once like this. Spans are recorded to the
+    caller's trace.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, function, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def save_png(image: Image.Image, file: BinaryIO) -> None:
+    """Save an image a codec made as a PNG, for when the caller doesn't say how to save it."""
+    with span("save"):
+        image.save(file, format="PNG")
+
+
+def read_prefix(image: Image.Image, length: int) -> bytes:
+    """Get the first ``length`` raw bytes of an image, or all of them if it is smaller, only reading the rows needed."""
+    rows = ImageRows(image)
+    length = min(length, len(rows))
+    if not length:
+        return b""
+    data, _ = rows.read(0, length)
+    return data[:length]
+
+
+def text_confidence(sample: bytes) -> float:
+    """Score how likely some bytes are to be the start of a text message, rather than chance, from 0 to 1.
+
+    Each lower case letter or space counts for it, being about four times as
+    likely in text as in random bytes, as do capitals starting words. Bytes
+    which aren't valid UTF-8 or are control characters count heavily against
+    it. Only a couple of letters are needed to be more likely than not, so
+    even short messages score well, but smooth parts of an image can repeat a
+    few letters over and over, which counts for little.
+    """
+    # a character cut off at the end of the sample is left out
+    if is_periodic(sample):
+        return 1 / (1 + 2**TEXT_PRIOR_BITS)
+    text = codecs.getincrementaldecoder("utf-8")(errors="replace").decode(sample)
+    evidence = 0.0
+    seen: dict[str, int] = {}
+    for index, char in enumerate(text):
+        seen[char] = seen.get(char, 0) + 1
+        if char == "\ufffd" or not (char.isprintable() or char in "\t\n\r"):
+            evidence -= 4
+        elif seen[char] > 3:
+            # text uses many different letters, where images tend to repeat the same few
+            evidence += 0.5
+        elif char.islower() or char == " " or (char.isupper() and (index == 0 or text[index - 1] == " ")):
+            evidence += 2
+        elif char.isascii():
+            evidence += 0.5
+        elif char.isalpha():
+            # letters of other scripts take several bytes, which are unlikely to be valid by chance
+            evidence += 1
+    # in bits, against the few bits of chance from trying several ways of reading a message
+    return 1 / (1 + 2 ** min(64, TEXT_PRIOR_BITS - evidence))
+
+
+def is_periodic(sample: bytes, max_period: int = 6) -> bool:
+    """Check whether some bytes mostly repeat themselves every few bytes, at least four times over."""
+    for period in range(1, max_period + 1):
+        if len(sample) < period * 4:
+            break
+        repeats = sum(map(operator.eq, sample[period:], sample))
+        if repeats > (len(sample) - period) * 2 // 3:
+            return True
+    return False
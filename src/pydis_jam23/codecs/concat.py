@@ -4,18 +4,51 @@ Concat codec appends data to image using a custom encoding, which consists
 of the XOR operator and bit-shift operator, and uses it as a storing format.
 When data is retrieved/decoded then the secret code will be displayed on the
 image like a scratch code thing but digital.
+
+By default the secret is written over the start of the pixel data. In
+trailer mode it is instead appended to the image file itself, after the end
+of the image, which never needs the pixels to be decoded or re-encoded.
 """
 
+import io
+import shutil
 import string
+from functools import cache
+from typing import BinaryIO
+
+import numpy as np
 from PIL import Image, ImageDraw
-from .common import CodecError
+
+from .common import (
+    CodecError,
+    CodecParam,
+    ImageRows,
+    Probe,
+    SaveImage,
+    array_to_image,
+    image_to_array,
+    prepare_pixels,
+    read_prefix,
+    save_png,
+)
+from .trace import span
 
 short_name = "concat"
 display_name = "Concat"
 cli_flag = "--concat"
 cli_help = "appends encoded secret into the image"
 
-params = []
+params = [
+    CodecParam(
+        name="trailer",
+        type_=bool,
+        default=False,
+        required=False,
+        display_name="Trailer",
+        help_="append the secret after the end of the image file, leaving the pixels untouched",
+        cli_flag="trailer",
+    ),
+]
 encode_params = []
 decode_params = []
 
@@ -26,6 +59,8 @@ buf_size = 2**8  # see which buffer size gives the faster time
 class DataSect:
     start = b"START"
     end = b"END"
+    # marks the fixed width format, which supports arbitrary binary data
+    version = b"v2"
 
 
 class BitShift:
@@ -34,24 +69,61 @@ class BitShift:
     _max = 7
 
 
-def bit_shift_encoding(message: bytes, shift: BitShift = BitShift._min):
-    msg = []
-    for _byte in range(len(message)):
-        msg.append(hex((message[_byte] << shift) ^ message[_byte])[2:])
-    return "".join(msg)
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+HEX_VALUES = np.full(256, -1, dtype=np.int16)
+HEX_VALUES[HEX_DIGITS] = np.arange(16)
+LEGACY_CHARSET = np.frombuffer(f"{string.ascii_letters+string.digits} ".encode(), dtype=np.uint8)
+
+
+def encoded_width(shift: int) -> int:
+    """The number of hex digits each encoded byte takes up at a shift level."""
+    return len(f"{(0xFF << shift) ^ 0xFF:x}")
+
+
+@cache
+def decoding_table(shift: int) -> np.ndarray:
+    """Map every value of the encoded width back to the byte it came from, or -1."""
+    plain = np.arange(256, dtype=np.int32)
+    table = np.full(16 ** encoded_width(shift), -1, dtype=np.int16)
+    table[(plain << shift) ^ plain] = plain
+    return table
+
+
+def bit_shift_encoding(message: bytes, shift: BitShift = BitShift._min) -> bytes:
+    """Encode each byte as ``(byte << shift) ^ byte``, in fixed width hex."""
+    width = encoded_width(shift)
+    plain = np.frombuffer(message, dtype=np.uint8).astype(np.int32)
+    encoded = (plain << shift) ^ plain
+    nibbles = (encoded[:, np.newaxis] >> np.arange(4 * (width - 1), -1, -4)) & 0xF
+    return HEX_DIGITS[nibbles].tobytes()
+
+
+def bit_shift_decoding(message: bytes, shift: BitShift = BitShift._min) -> bytes:
+    """Invert `bit_shift_encoding` with a single table lookup per byte."""
+    width = encoded_width(shift)
+    digits = HEX_VALUES[np.frombuffer(message, dtype=np.uint8)].astype(np.int32)
+    if len(digits) % width or (digits < 0).any():
+        msg = "Secret message is corrupted."
+        raise CodecError(msg)
+    encoded = np.zeros(len(digits) // width, dtype=np.int32)
+    for column in digits.reshape(-1, width).T:
+        encoded = (encoded << 4) | column
+    decoded = decoding_table(shift)[encoded]
+    if (decoded < 0).any():
+        msg = "Secret message is corrupted."
+        raise CodecError(msg)
+    return decoded.astype(np.uint8).tobytes()
 
 
-def bit_shift_decoding(message: str, shift: BitShift = BitShift._min, charset=None):
-    msg = []
-    charset = list(f"{string.ascii_letters+string.digits} ".encode()) if charset is None else charset
-    enc_msg = bytes.fromhex(message)
-    for _byte in range(len(enc_msg)):
-        for test_byte in charset:
-            if (enc_msg[_byte] ^ (test_byte << shift)) in charset and (
-                (test_byte << shift) ^ enc_msg[_byte]
-            ) == test_byte:
-                msg.append(test_byte)
-    return "".join([chr(i) for i in msg])
+def legacy_bit_shift_decoding(message: bytes, shift: BitShift = BitShift._min) -> bytes:
+    """Decode the original variable width format, which only supported letters, digits and spaces."""
+    try:
+        encoded = bytes.fromhex(message.decode("ascii"))
+    except ValueError as e:
+        msg = "Secret message is corrupted."
+        raise CodecError(msg) from e
+    decoded = decoding_table(shift)[np.frombuffer(encoded, dtype=np.uint8)]
+    return decoded[np.isin(decoded, LEGACY_CHARSET)].astype(np.uint8).tobytes()
 
 
 def write_text_on_image(image: Image.Image, text: str):
@@ -59,25 +131,177 @@ def write_text_on_image(image: Image.Image, text: str):
     im.text((15, 15), text)
 
 
-def encode(image: Image.Image, secret: bytes, shift_level: BitShift = BitShift._min):
-    data = image.tobytes()
-    if data.find(DataSect.start) >= 0 and data.find(DataSect.end) >= 0:
+def find_secret(data: bytes) -> bytes | None:
+    """Find the encoded secret between the data section markers, if there is one."""
+    start = data.find(DataSect.start)
+    if start < 0:
+        return None
+    start += len(DataSect.start)
+    end = data.find(DataSect.end, start)
+    if end < 0:
+        return None
+    return data[start:end]
+
+
+def pack_secret(secret: bytes, shift_level: BitShift = BitShift._min) -> bytes:
+    """Encode a secret and wrap it in the data section markers."""
+    return DataSect.start + DataSect.version + bit_shift_encoding(secret, shift=shift_level) + DataSect.end
+
+
+def unpack_secret(secret: bytes, shift_level: BitShift = BitShift._min) -> bytes:
+    """Decode a secret found between the data section markers."""
+    if secret.startswith(DataSect.version):
+        return bit_shift_decoding(secret[len(DataSect.version) :], shift=shift_level)
+    return legacy_bit_shift_decoding(secret, shift=shift_level)
+
+
+def encode(image: Image.Image, secret: bytes, shift_level: BitShift = BitShift._min, *, trailer: bool = False):
+    pixels = encode_array(image_to_array(image), image.mode, secret, shift_level, in_place=True, trailer=trailer)
+    return array_to_image(pixels, image.mode, image.size)
+
+
+def decode(image: Image.Image, shift_level: BitShift = BitShift._min, *, trailer: bool = False):
+    dec_msg = decode_array(image_to_array(image, writable=False), image.mode, shift_level, trailer=trailer)
+    render_secret(image, dec_msg)
+    return dec_msg
+
+
+def render_secret(image: Image.Image, secret: bytes) -> None:
+    """Draw a decoded secret over an image, as `decode` does."""
+    with span("render"):
+        write_text_on_image(image, secret.decode("latin-1"))
+
+
+def capacity(image: Image.Image, shift_level: BitShift = BitShift._min, *, trailer: bool = False) -> int | None:
+    """Find the length of the longest secret that can be encoded into an image.
+
+    In trailer mode the secret is appended to the file, so there is no limit.
+    """
+    if trailer:
+        return None
+    framing = len(DataSect.start) + len(DataSect.version) + len(DataSect.end)
+    return max(0, (image.width * image.height - framing) // encoded_width(shift_level))
+
+
+def probe(image: Image.Image) -> Probe:
+    """Guess whether an image holds a secret from the start marker in the first channel of its first pixels.
+
+    Secrets in trailers are after the end of the image, so aren't found.
+    """
+    marker = DataSect.start + DataSect.version
+    rows = ImageRows(image)
+    # first_channel only picks a channel out of 8 bit images, where each pixel is a whole number of bytes
+    bands = len(image.getbands()) if rows.row_size == image.width * len(image.getbands()) else 1
+    start = read_prefix(image, len(marker) * bands)[::bands]
+    if start == marker:
+        return Probe(1.0)
+    if start.startswith(DataSect.start):
+        # written by the original, variable width format
+        return Probe(0.9)
+    return Probe(0.0)
+
+
+def encode_array(
+    pixels: np.ndarray,
+    mode: str,  # noqa: ARG001
+    secret: bytes,
+    shift_level: BitShift = BitShift._min,
+    *,
+    in_place: bool = False,
+    trailer: bool = False,
+) -> np.ndarray:
+    if trailer:
+        msg = "Trailer mode works on the original image file, so can't be used on its pixels."
+        raise CodecError(msg)
+    # the secret is stored in the first channel of the pixels, starting from the first one
+    if find_secret(first_channel(pixels).tobytes()) is not None:
         msg = "Image already has a secret message"
         raise CodecError(msg)
+    enc_msg = pack_secret(secret, shift_level)
+    if len(enc_msg) > pixels.shape[0] * pixels.shape[1]:
+        msg = "Message is too long to fit in image."
+        raise CodecError(msg)
+    pixels = prepare_pixels(pixels, in_place)
+    # the same as putdata, which zeroes the other channels
+    with span("embed"):
+        rows = pixels.reshape(pixels.shape[0] * pixels.shape[1], -1)
+        rows[: len(enc_msg)] = 0
+        rows[: len(enc_msg), 0] = np.frombuffer(enc_msg, dtype=np.uint8)
+    return pixels
+
+
+def decode_array(
+    pixels: np.ndarray, mode: str, shift_level: BitShift = BitShift._min, *, trailer: bool = False  # noqa: ARG001
+) -> bytes:
+    if trailer:
+        msg = "Trailer mode works on the original image file, so can't be used on its pixels."
+        raise CodecError(msg)
+    with span("extract"):
+        secret = find_secret(first_channel(pixels).tobytes())
+    if secret is None:
+        msg = "Image does not contain a message."
+        raise CodecError(msg)
+    with span("unpack"):
+        return unpack_secret(secret, shift_level)
+
+
+def first_channel(pixels: np.ndarray) -> np.ndarray:
+    """Get the first channel of each pixel, which is where the secret is stored."""
+    return pixels[..., 0] if pixels.ndim == 3 else pixels
+
+
+def encode_file(
+    source: BinaryIO,
+    target: BinaryIO,
+    secret: bytes,
+    shift_level: BitShift = BitShift._min,
+    *,
+    trailer: bool = False,
+    save: SaveImage = save_png,
+) -> None:
+    """Encode a secret into an image file, writing the new file to ``target``.
+
+    In trailer mode the original file is copied through unchanged, followed by
+    the secret, so the pixels are never decoded. Image viewers stop reading at
+    the container's own end marker (such as PNG's IEND chunk) and ignore it.
+    Otherwise this is `encode`, saving the result with ``save``.
+    """
+    if not trailer:
+        save(encode(Image.open(source), secret, shift_level), target)
         return
-    enc_msg = bit_shift_encoding(secret, shift=shift_level)
-    image.putdata(DataSect.start + enc_msg.encode() + DataSect.end)
-    return image
-
-
-def decode(image: Image.Image, shift_level: BitShift = BitShift._min):
-    image_data = image.tobytes()
-    _data = []
-    for i in list(image_data):
-        if i != 0:
-            _data.append(i)
-    secret = bytearray(_data)
-    secret = secret[secret.find(DataSect.start) + len(DataSect.start) : secret.find(DataSect.end)].decode()
-    dec_msg = bit_shift_decoding(secret, shift=shift_level)
-    write_text_on_image(image, dec_msg)
-    return dec_msg.encode()
+    if read_trailer(source) is not None:
+        msg = "Image already has a secret message"
+        raise CodecError(msg)
+    source.seek(0)
+    shutil.copyfileobj(source, target)
+    target.write(pack_secret(secret, shift_level))
+
+
+def decode_file(source: BinaryIO, shift_level: BitShift = BitShift._min, *, trailer: bool = False) -> bytes:
+    """Decode a secret from an image file, only reading its tail in trailer mode."""
+    if not trailer:
+        return decode(Image.open(source), shift_level)
+    secret = read_trailer(source)
+    if secret is None:
+        msg = "Image does not contain a message."
+        raise CodecError(msg)
+    return unpack_secret(secret, shift_level)
+
+
+def read_trailer(source: BinaryIO) -> bytes | None:
+    """Find a secret appended to the end of a file, reading back from the end in growing chunks."""
+    size = source.seek(0, io.SEEK_END)
+    chunk_size = buf_size
+    while True:
+        start = max(0, size - chunk_size)
+        source.seek(start)
+        tail = source.read()
+        if not tail.endswith(DataSect.end):
+            return None
+        # the encoded secret is lowercase hex, so can't contain the start marker
+        secret_start = tail.rfind(DataSect.start)
+        if secret_start >= 0:
+            return tail[secret_start + len(DataSect.start) : -len(DataSect.end)]
+        if start == 0:
+            return None
+        chunk_size *= 2
@@ -0,0 +1,86 @@
+"""Find which codec hid a message in an image, without being told.
+
+Every codec's `probe` only looks at the start of the image, so they can all
+be tried at once, and usually just the most likely codec is used to decode
+the whole message. Codecs needing a password can't be detected.
+"""
+from dataclasses import dataclass
+
+from PIL import Image
+
+from . import CODECS, Codec
+from .common import CodecError, Probe, map_threads, text_confidence
+from .trace import span
+
+# a candidate needs to be more likely than this to have found a message, rather than chance
+LIKELY_CONFIDENCE = 0.5
+# how much of a decoded message to check looks like text
+VERIFY_SAMPLE_SIZE = 256
+
+
+class NoMessageError(CodecError):
+    """No codec was confident of having found a message."""
+
+
+@dataclass(frozen=True)
+class Candidate:
+    codec: Codec
+    probe: Probe
+
+    def describe(self) -> str:
+        """Describe the codec and the arguments it would decode with, and how likely it is."""
+        details = []
+        for param in self.codec.params + self.codec.decode_params:
+            value = self.probe.args.get(param.name)
+            if value is True:
+                details.append(param.display_name)
+            elif value not in (None, False):
+                details.append(f"{param.display_name} {value}")
+        details.append(f"{self.probe.confidence:.0%} confidence")
+        return f"{self.codec.display_name} ({', '.join(details)})"
+
+
+def rank(image: Image.Image, workers: int | None = None) -> list[Candidate]:
+    """Probe an image with every codec concurrently, returning the possible ones, most likely first.
+
+    Codecs earlier in `CODECS` win ties.
+    """
+    # the probes share the image, so it has to be decoded before they start
+    image.load()
+    with span("probe"):
+        probes = map_threads(lambda codec: codec.probe(image), CODECS, workers)
+    candidates = [Candidate(codec, probe) for codec, probe in zip(CODECS, probes, strict=True) if probe.confidence > 0]
+    return sorted(candidates, key=lambda candidate: candidate.probe.confidence, reverse=True)
+
+
+def decode(image: Image.Image, workers: int | None = None, *, force: bool = False) -> tuple[Candidate, bytes]:
+    """Decode a message with the most likely codec, returning it with the candidate used.
+
+    A candidate's confidence is raised if the message it decodes looks like
+    text, which is the only real evidence for codecs like edges, whose probes
+    can't see the message. Only if that still leaves it unlikely (or it can't
+    find a message at all) is the next most likely tried, so usually only one
+    codec decodes the image.
+
+    :param force: Use the most likely candidate which decodes anything, even if it is unlikely to be a message.
+    :raises NoMessageError: If no candidate is likely to have found a message, unless forced.
+    """
+    best: tuple[Candidate, bytes] | None = None
+    for candidate in rank(image, workers):
+        try:
+            message = candidate.codec.decode(image, **candidate.probe.args)
+        except CodecError:
+            continue
+        confidence = max(candidate.probe.confidence, text_confidence(message[:VERIFY_SAMPLE_SIZE]))
+        verified = Candidate(candidate.codec, Probe(confidence, candidate.probe.args))
+        if confidence > LIKELY_CONFIDENCE:
+            return verified, message
+        if best is None or confidence > best[0].probe.confidence:
+            best = verified, message
+    if best is None:
+        msg = "No codec found a message in the image."
+        raise NoMessageError(msg)
+    if force:
+        return best
+    msg = f"No message was found, the best guess was {best[0].describe()}."
+    raise NoMessageError(msg)
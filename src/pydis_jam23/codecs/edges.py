@@ -9,12 +9,30 @@ to store data in the other two channels.
 Which channels is used is marked on the 0,0 pixel.
 Channel with a 1 as LSB is the mask
 """
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
 from random import randint
 from typing import Any
 
+import numpy as np
 from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
 
-from .common import CodecError, decode_varint, encode_varint
+from .common import (
+    CodecError,
+    Probe,
+    array_to_image,
+    decode_varint,
+    encode_varint,
+    flat_pixels,
+    image_to_array,
+    max_message_length,
+    prepare_pixels,
+    read_prefix,
+)
+from .trace import span
 
 short_name = "edges"
 display_name = "Edges"
@@ -27,40 +45,106 @@ decode_params = []
 
 ALLOWED_MODES = {"RGB": 3, "RGBA": 3, "CMYK": 4, "YCbCr": 4, "HSV": 3}
 
+CONTRAST_FACTOR = 15
+MEDIAN_SIZE = 3
 
-def encode(image: Image.Image, message: bytes, *, test_channel: int | None = None, **codec_args: Any) -> Image.Image:
+
+def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image:
     """encode a message into an image using the above described method"""
+    pixels = encode_array(image_to_array(image), image.mode, message, in_place=True, **codec_args)
+    return array_to_image(pixels, image.mode, image.size)
+
+
+def decode(image: Image.Image, **codec_args: Any) -> bytes:
+    return decode_array(image_to_array(image, writable=False), image.mode, **codec_args)
+
+
+def capacity(image: Image.Image, **codec_args: Any) -> int:
+    """Find the length of the longest message that can be encoded into an image.
+
+    This needs the edge mask of every channel, but they are cached, so
+    encoding into the same image afterwards doesn't compute them again.
+    """
+    return capacity_array(image_to_array(image, writable=False), image.mode, **codec_args)
+
+
+def capacity_array(pixels: np.ndarray, mode: str, **codec_args: Any) -> int:
+    """Find the length of the longest message that can be encoded into a ``(height, width, bands)`` array of pixels."""
+    if codec_args:
+        msg = f"Unexpected codec arguments: {codec_args}"
+        raise TypeError(msg)
+    if mode not in ALLOWED_MODES.keys():
+        msg = f"Image is in a wrong color mode. ({mode}) use one of these instead: {list(ALLOWED_MODES.keys())}."
+        raise CodecError(msg)
+    num_channels = ALLOWED_MODES[mode]
+    masks = channel_masks(pixels, range(num_channels))
+    # count the channels of non edge pixels, skipping pixel 0,0
+    free_pixels = max(count_color(edges[1:], 0) for edges in masks)
+    return max_message_length(free_pixels * (num_channels - 1) // 8)
+
+
+def probe(image: Image.Image) -> Probe:
+    """Guess whether an image holds a message from the marker in its first pixel.
+
+    Exactly one channel's LSB is set, marking the mask, which random pixels
+    often have by chance too, so this is only weak evidence.
+    Checking the message length would need the whole edge mask.
+    """
+    if image.mode not in ALLOWED_MODES:
+        return Probe(0.0)
+    marker = read_prefix(image, ALLOWED_MODES[image.mode])
+    return Probe(0.25 if sum(byte & 1 for byte in marker) == 1 else 0.0)
+
+
+def encode_array(
+    pixels: np.ndarray,
+    mode: str,
+    message: bytes,
+    *,
+    in_place: bool = False,
+    test_channel: int | None = None,
+    **codec_args: Any,
+) -> np.ndarray:
+    """encode a message into a ``(height, width, bands)`` array of pixels"""
     if codec_args:
         msg = f"Unexpected codec arguments: {codec_args}"
         raise TypeError(msg)
 
-    image_data = bytearray(image.tobytes())
     data = encode_varint(len(message)) + message
 
-    if image.mode not in ALLOWED_MODES.keys():
-        msg = f"Image is in a wrong color mode. ({image.mode}) use one of these instead: {list(ALLOWED_MODES.keys())}."
+    if mode not in ALLOWED_MODES.keys():
+        msg = f"Image is in a wrong color mode. ({mode}) use one of these instead: {list(ALLOWED_MODES.keys())}."
         raise CodecError(msg)
 
-    num_channels = ALLOWED_MODES[image.mode]
+    num_channels = ALLOWED_MODES[mode]
     num_data_channels = num_channels - 1
 
     if test_channel is None:
         mask_color = randint(0, num_data_channels)  # noqa: S311 no need for crypto
     else:
         mask_color = test_channel
-    alternative_trys = 0
 
-    # check if the channels is big enugh for the message
-    # try the other ones if not
-    while True:
-        edges = get_edges(image.split()[mask_color]).tobytes()
-        if count_color(edges, 0) > len(data):  # count edge pixels
+    # use the first mask in order of preference that is big enough for the message
+    candidates = [(mask_color + offset) % num_channels for offset in range(num_channels)]
+    masks = channel_masks(pixels, candidates)
+    for candidate, edges in zip(candidates, masks, strict=True):
+        # count the channels of non edge pixels, skipping pixel 0,0
+        if count_color(edges[1:], 0) * num_data_channels >= len(data) * 8:
+            mask_color = candidate
             break
-        elif alternative_trys >= num_data_channels:
-            msg = "The message is too long to be encoded into this image."
-            raise CodecError(msg)
-        alternative_trys += 1
-        mask_color = (mask_color + 1) % num_channels
+    else:
+        msg = "The message is too long to be encoded into this image."
+        raise CodecError(msg)
+
+    # get data spaces at index 1 -> as index 0 (pixel 0,0) marks the color layer used as mask
+    with span("positions"):
+        data_indices = generate_data_indeces(edges, mask_color, len(data) * 8, 1, num_channels)
+    if len(data_indices) < len(data) * 8:
+        msg = "The message is too long to be encoded into this image."
+        raise CodecError(msg)
+
+    pixels = prepare_pixels(pixels, in_place)
+    image_data = flat_pixels(pixels)
 
     for idx in range(0, num_channels):  # set all LSB of the first pixel to 0
         image_data[idx] = set_lsb(image_data[idx], 0)
@@ -68,33 +152,26 @@ def encode(image: Image.Image, message: bytes, *, test_channel: int | None = Non
     # set the LSB of the color that is used as information mask to 1
     image_data[mask_color] = set_lsb(image_data[mask_color], 1)
 
-    # get data spaces at index 1 -> as index 0 (pixel 0,0) marks the color layer used as mask
-    data_indices = generate_data_indeces(edges, mask_color, len(data) * 8, 1, num_channels)
-
-    # split bytes to bits
-    message_binary = []
-    for byte in data:
-        for bit_idx in range(8):
-            message_binary.append((byte >> bit_idx) & 1)
+    # split bytes to bits and modify the image
+    with span("embed"):
+        message_binary = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")
+        image_data[data_indices] = (image_data[data_indices] & 0b1111_1110) | message_binary
 
-    # modify the image
-    for bit_idx, pixel_idx in enumerate(data_indices):
-        image_data[pixel_idx] = set_lsb(image_data[pixel_idx], message_binary[bit_idx])
+    return pixels
 
-    return Image.frombytes(image.mode, image.size, image_data)
 
-
-def decode(image: Image.Image, **codec_args: Any) -> bytes:
+def decode_array(pixels: np.ndarray, mode: str, **codec_args: Any) -> bytes:
+    """decode a message from a ``(height, width, bands)`` array of pixels"""
     if codec_args:
         msg = f"Unexpected codec arguments: {codec_args}"
         raise TypeError(msg)
-    data = image.tobytes()
+    data = flat_pixels(pixels)
 
-    if image.mode not in ALLOWED_MODES.keys():
-        msg = f"Image is in a wrong color mode. ({image.mode}) use one of these instead: {ALLOWED_MODES}."
+    if mode not in ALLOWED_MODES.keys():
+        msg = f"Image is in a wrong color mode. ({mode}) use one of these instead: {ALLOWED_MODES}."
         raise CodecError(msg)
 
-    num_channels = ALLOWED_MODES[image.mode]  # not best practise but we filter all non compatible codecs
+    num_channels = ALLOWED_MODES[mode]  # not best practise but we filter all non compatible codecs
 
     # get the layer wich is used as the mask
     mask_color = None
@@ -111,86 +188,48 @@ def decode(image: Image.Image, **codec_args: Any) -> bytes:
         raise CodecError(msg)
 
     # generate the mask that was used to encode the data
-    edges = get_edges(image.split()[mask_color]).tobytes()
+    with span("masks"):
+        edges = mask_cache.get_edges(channel_image(pixels, mask_color))
 
-    offset = 1
+    offset = 0
 
-    def wrapper_for_next_byte() -> int:
+    def read_bytes(length: int) -> bytes:
         nonlocal offset
-        byte, new_offset = read_next_byte(edges, data, mask_color, offset, num_channels)
-        offset = new_offset
-        return byte[0]
+        end = offset + length * 8
+        with span("positions"):
+            data_indices = generate_data_indeces(edges, mask_color, end, 1, num_channels)
+        if len(data_indices) < end:
+            msg = "Image contains no data or is corrupted."
+            raise CodecError(msg)
+        with span("extract"):
+            message_binary = data[data_indices[offset:end]] & 1
+            offset = end
+            return np.packbits(message_binary, bitorder="little").tobytes()
 
-    length = decode_varint(wrapper_for_next_byte)
+    length = decode_varint(lambda: read_bytes(1)[0])
 
     # finally load message
-    message = b""
-    for _ in range(length):
-        new_byte, new_offset = read_next_byte(edges, data, mask_color, offset, num_channels)
-        offset = new_offset
-        message += new_byte
-
-    return message
+    return read_bytes(length)
 
 
-def count_color(image: bytes, color: int | tuple[int, int, int]) -> int:
-    """Count the how many pixels have a color in an image"""
+def channel_masks(pixels: np.ndarray, channels: Iterable[int]) -> list[bytes]:
+    """Get the edge masks of some channels of an array of pixels.
 
-    count = 0
-    for pixel in image:
-        if pixel == color:
-            count += 1
-    return count
+    They are computed at once, as the filters release the GIL.
+    """
+    channels = list(channels)
+    with span("masks"), ThreadPoolExecutor(max_workers=len(channels)) as pool:
+        return list(pool.map(lambda color: mask_cache.get_edges(channel_image(pixels, color)), channels))
 
 
-def read_next_byte(
-    edges: bytes, image_data: bytes, mask_color: int, pixel_index_offset: int, channel_count: int
-) -> tuple[bytes, int]:
-    """Read the next byte of data out of an image while accounting for the edges mask
+def channel_image(pixels: np.ndarray, channel: int) -> Image.Image:
+    """Get one channel of an array of pixels as a greyscale image."""
+    return Image.fromarray(np.ascontiguousarray(pixels[..., channel]), "L")
 
-    :param edges: The raw byte data of the edges mask 0 -> Edge
-    :param image_data: Raw data of the image 3 Bytes per pixel RGB
-    :param mask_color: The index of wich channel is represented by edges 0-R 1-G 2-B
-    :param pixel_index_offset: the index of the pixel on wich the function starts searching
-    :return: tuple, the data of the byte and the pixel it has stopped on
-    :raises: Codec error when no data is found"""
-    output_byte = []
-
-    pixel_index = pixel_index_offset
-    color_offset = 0
-    # stop when 8 bit are found
-    while len(output_byte) < 8:
-        # skip when the pixels is no data pixel
-        if edges[pixel_index] == 0:
-            # convert pixel index to image index which is in RGB so 3 byte per pixel
-            pixel_start = pixel_index * channel_count
-            # read both channels that are not part of the mask
-            if color_offset != mask_color:
-                # %2 is used to get the LSB
-                output_byte.append(image_data[pixel_start + color_offset] % 2)
-            color_offset += 1
-
-            # if done with the pixel move on the next
-            if color_offset > channel_count - 1:
-                pixel_index += 1
-                color_offset = 0
-
-        else:
-            pixel_index += 1
-
-        # if we are looking at pixels outside the image no data was found
-        if pixel_index > len(edges):
-            msg = "Image contains no data or is corrupted."
-            raise CodecError(msg)
 
-    output = 0
-    for i, bit_value in enumerate(output_byte):
-        output += bit_value * (2**i)
-
-    if color_offset == 2:
-        pixel_index += 1
-
-    return output.to_bytes(1, "big"), pixel_index
+def count_color(image: bytes, color: int) -> int:
+    """Count the how many pixels have a color in a single channel image"""
+    return int(np.count_nonzero(np.frombuffer(image, dtype=np.uint8) == color))
 
 
 def set_lsb(pixel: bytes, lsb_value: int) -> bytes:
@@ -199,41 +238,40 @@ def set_lsb(pixel: bytes, lsb_value: int) -> bytes:
 
 def generate_data_indeces(
     edges: bytes, mask_color: int, message_length: int, start_byte: int, channel_count: int
-) -> list[int]:
+) -> np.ndarray:
     """Generate The indeces in the bytearray of the image where the data will
     be located
 
+    Every channel but the mask one of each pixel that is not an edge is used,
+    in order. The mask is searched in growing windows, so only about as much of
+    it as the message needs is scanned.
+
     :param edges: raw data of the edge mask 0-> Edge
     :param mask_color: The index of wich channel is represented by edges 0-R 1-G 2-B
     :param message_length: the amount of bits the data will contain
     :param start_byte: the index in edges where the search will begin
-    :return: a list of indexs for the original image in wich the data will be encoded its length == message_length
+    :return: an array of indexs for the original image in wich the data will be encoded, its length is
+        message_length, or less if the image runs out of space
     """
-    pixel_index = start_byte
-    data_indices = []
-    offset_index = 0
-
-    # only create value until message_length is reached
-    while len(data_indices) < message_length:
+    mask = np.frombuffer(edges, dtype=np.uint8)
+    data_channels = np.array([channel for channel in range(channel_count) if channel != mask_color])
+    pixels_needed = -(-message_length // len(data_channels))
+
+    found = []
+    pixels_found = 0
+    window = max(pixels_needed * 2, 4096)
+    while pixels_found < pixels_needed and start_byte < len(mask):
         # if the pixels is black in the mask, use it for data
-        if edges[pixel_index] == 0:
-            # tranfer between greayscale an rgb
-            first_in_pixel = pixel_index * channel_count
-
-            # ensure that data is only saved on the non mask color layer
-            if offset_index != mask_color:
-                data_indices.append(first_in_pixel + offset_index)
-            offset_index += 1
-
-            # only go to next pixel if channels have been filled
-            if offset_index > channel_count - 1:
-                pixel_index += 1
-                offset_index = 0
-        else:
-            # skip the pixels
-            pixel_index += 1
+        free_pixels = np.flatnonzero(mask[start_byte : start_byte + window] == 0) + start_byte
+        found.append(free_pixels)
+        pixels_found += len(free_pixels)
+        start_byte += window
+        window *= 2
+    pixel_indices = np.concatenate(found)[:pixels_needed] if found else np.zeros(0, dtype=np.intp)
 
-    return data_indices
+    # tranfer between greayscale an rgb, ensuring data is only saved on the non mask color layers
+    data_indices = (pixel_indices[:, np.newaxis] * channel_count + data_channels).reshape(-1)
+    return data_indices[:message_length]
 
 
 def get_edges(image: Image.Image) -> Image.Image:
@@ -247,10 +285,10 @@ def get_edges(image: Image.Image) -> Image.Image:
 
     # increase saturation to increase difference between noise and actual adges
     enhancer = ImageEnhance.Contrast(contours)
-    high_contrast = enhancer.enhance(15)
+    high_contrast = enhancer.enhance(CONTRAST_FACTOR)
 
     # filter out the noise
-    cleand = high_contrast.filter(ImageFilter.MedianFilter)
+    cleand = high_contrast.filter(ImageFilter.MedianFilter(MEDIAN_SIZE))
 
     # make image binary
     black_white = cleand.convert("1")
@@ -261,3 +299,77 @@ def get_edges(image: Image.Image) -> Image.Image:
 
     # make it greayscale again because its easyer to iterate over bytes then bits
     return black_white.convert("L")
+
+
+class MaskCache:
+    """A bounded LRU cache of edge masks.
+
+    Masks are keyed by a digest of the channel they were computed from, along
+    with the mask parameters, so the same cover can be probed, encoded and
+    decoded repeatedly without rerunning the filters. Least recently used
+    masks are evicted once their total size exceeds ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._masks: OrderedDict[bytes, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_edges(self, channel: Image.Image) -> bytes:
+        """Get the raw edge mask for a single channel image, as `get_edges` would give."""
+        key = self.key(channel)
+        with self._lock:
+            edges = self._masks.get(key)
+            if edges is not None:
+                self._masks.move_to_end(key)
+                self.hits += 1
+                return edges
+            self.misses += 1
+        edges = get_edges(channel).tobytes()
+        with self._lock:
+            if key not in self._masks and len(edges) <= self.max_bytes:
+                self._masks[key] = edges
+                self.size += len(edges)
+            self._evict()
+        return edges
+
+    def resize(self, max_bytes: int) -> None:
+        """Change the memory ceiling, evicting masks as necessary."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """Drop all cached masks and reset the counters."""
+        with self._lock:
+            self._masks.clear()
+            self.size = self.hits = self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """Get the hit and miss counters and current usage, for sizing the cache."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._masks),
+                "size": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+    @staticmethod
+    def key(channel: Image.Image) -> bytes:
+        hasher = blake2b(digest_size=32)
+        hasher.update(f"{channel.size}:{CONTRAST_FACTOR}:{MEDIAN_SIZE}:".encode())
+        hasher.update(channel.tobytes())
+        return hasher.digest()
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes:
+            _, edges = self._masks.popitem(last=False)
+            self.size -= len(edges)
+
+
+mask_cache = MaskCache(max_bytes=256 * 2**20)
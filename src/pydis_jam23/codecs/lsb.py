@@ -6,12 +6,29 @@ data per pixel. Your message will be prefixed with its length, itself encoded
 using a variable length encoding to avoid a large section of zeros at the start
 of the message giving it away.
 """
-from collections.abc import Iterator
+from collections.abc import Callable, Iterable, Iterator
 from typing import Any
 
+import numpy as np
 from PIL import Image
 
-from .common import CodecError, CodecParam, decode_varint, encode_varint
+from .common import (
+    CodecError,
+    CodecParam,
+    ImageRows,
+    Probe,
+    array_to_image,
+    decode_varint,
+    encode_varint,
+    flat_pixels,
+    image_to_array,
+    max_message_length,
+    prepare_pixels,
+    raw_size,
+    read_prefix,
+    text_confidence,
+)
+from .trace import span
 
 short_name = "lsb"
 display_name = "LSB"
@@ -41,43 +58,200 @@ params = [
 encode_params = []
 decode_params = []
 
+STREAM_CHUNK_SIZE = 2**16
+# message bytes read or written at a time, bounding the bit planes unpacked at once
+BLOCK_SIZE = 2**16
+# how much of the start of a message to check looks like text when probing
+PROBE_SAMPLE_SIZE = 32
+
 
 def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image:
     """Encode a message into an image using our LSB encoding."""
-    bits, msb = validate_args(**codec_args)
-    if bits < 1 or bits > 8:
-        msg = "Bit count must be between 1 and 8."
-        raise CodecError(msg)
-    length = encode_varint(len(message))
-    message = length + message
-    data = bytearray(image.tobytes())
-    if len(message) * 8 > len(data) * bits:
+    if len(message) > capacity(image, **codec_args):
         msg = "Message is too long to fit in image."
         raise CodecError(msg)
-    for bit_idx, data_bit in enumerate(iterate_bits(message)):
-        pixel_idx, pixel_bit = divmod(bit_idx, bits)
-        shift = (7 - pixel_bit) if msb else pixel_bit
-        mask = ~(1 << shift)
-        pixel = data[pixel_idx] & mask  # clear the bit
-        pixel |= data_bit << shift  # set the bit
-        data[pixel_idx] = pixel
-    return Image.frombytes(image.mode, image.size, data)
+    pixels = encode_array(image_to_array(image), image.mode, message, in_place=True, **codec_args)
+    return array_to_image(pixels, image.mode, image.size)
 
 
 def decode(image: Image.Image, **codec_args: Any) -> bytes:
     """Decode a message from an image using our LSB encoding."""
     bits, msb = validate_args(**codec_args)
-    data = bytes(image.tobytes())
+    rows = ImageRows(image)
+    return read_message(lambda offset, length: read_bytes_from_rows(rows, offset, length, bits, msb))
+
+
+def capacity(image: Image.Image, **codec_args: Any) -> int:
+    """Find the length of the longest message that can be encoded into an image, from its size alone."""
+    bits, _ = validate_args(**codec_args)
+    return max_message_length(raw_size(image) * bits // 8)
+
+
+def recommend_bits(image: Image.Image, length: int) -> int | None:
+    """Find the smallest number of bits per pixel which fits a message of a given length, if any."""
+    for bits in range(1, 9):
+        if capacity(image, bits=bits, msb=False) >= length:
+            return bits
+    return None
+
+
+def probe(image: Image.Image) -> Probe:
+    """Guess whether an image holds a message, and with which arguments, from the start of each message it could hold.
+
+    The length must fit the image, and messages are usually text, so the
+    start of the message should look like text.
+    """
+    best = Probe(0.0)
+    for args, _, sample in probe_messages(image, PROBE_SAMPLE_SIZE):
+        confidence = text_confidence(sample)
+        if confidence > best.confidence:
+            best = Probe(confidence, args)
+    return best
+
+
+def probe_messages(image: Image.Image, sample_size: int) -> Iterator[tuple[dict[str, Any], int, bytes]]:
+    """Find the arguments the image could have been encoded with, with the length and start of each possible message.
+
+    Only the first rows of the image are read. Arguments are skipped where
+    the message's length wouldn't fit the image, or its length prefix is
+    padded by more than `encode_stream` would pad it.
+    """
+    space = raw_size(image)
+    header_size = len(encode_varint(space))
+    # enough for the longest length prefix and the sample, at one bit per byte
+    prefix = read_prefix(image, (header_size + sample_size) * 8)
+    # every bit plane of the prefix is unpacked once, and each set of arguments packs up its own planes from them
+    planes = np.unpackbits(np.frombuffer(prefix, dtype=np.uint8)[:, np.newaxis], axis=1, bitorder="little")
+    for bits in range(1, 9):
+        for msb in (False, True):
+            size = min(header_size + sample_size, len(prefix) * bits // 8)
+            used = planes[:, bit_positions(bits, msb)].reshape(-1)[: size * 8]
+            data = np.packbits(used, bitorder="little").tobytes()
+            try:
+                length, header_length = parse_length(data[:header_size])
+            except CodecError:
+                # the length prefix is longer than any the image could need
+                continue
+            if length > space * bits // 8 - header_length:
+                continue
+            if header_length > len(encode_varint(length)) and header_length != len(encode_varint(space * bits // 8)):
+                continue
+            yield {"bits": bits, "msb": msb}, length, data[header_length : header_length + min(length, sample_size)]
+
+
+def encode_stream(
+    image: Image.Image, chunks: Iterable[bytes], length: int | None = None, **codec_args: Any
+) -> Image.Image:
+    """Encode a message given as chunks into an image, without holding all of it in memory.
+
+    If the length of the message isn't known up front, space is reserved for
+    the length of the longest message that could fit, which is filled in
+    once the end of the message is reached. Otherwise the result is the same
+    as `encode`.
+    """
+    pixels = encode_stream_array(image_to_array(image), chunks, length, in_place=True, **codec_args)
+    return array_to_image(pixels, image.mode, image.size)
+
+
+def decode_stream(image: Image.Image, *, chunk_size: int = STREAM_CHUNK_SIZE, **codec_args: Any) -> Iterator[bytes]:
+    """Decode a message from an image in chunks, only reading the rows holding each one as it is needed."""
+    bits, msb = validate_args(**codec_args)
+    rows = ImageRows(image)
+    return read_message_chunks(lambda offset, length: read_bytes_from_rows(rows, offset, length, bits, msb), chunk_size)
+
+
+def encode_array(
+    pixels: np.ndarray, mode: str, message: bytes, *, in_place: bool = False, **codec_args: Any  # noqa: ARG001
+) -> np.ndarray:
+    """Encode a message into an array of pixels using our LSB encoding."""
+    bits, msb = validate_args(**codec_args)
+    if len(message) > max_message_length(pixels.size * bits // 8):
+        msg = "Message is too long to fit in image."
+        raise CodecError(msg)
+    pixels = prepare_pixels(pixels, in_place)
+    with span("embed"):
+        write_bytes_to_image(flat_pixels(pixels), 0, encode_varint(len(message)) + message, bits, msb)
+    return pixels
+
+
+def decode_array(pixels: np.ndarray, mode: str, **codec_args: Any) -> bytes:  # noqa: ARG001
+    """Decode a message from an array of pixels using our LSB encoding."""
+    bits, msb = validate_args(**codec_args)
+    data = flat_pixels(pixels)
+    with span("extract"):
+        return read_message(lambda offset, length: read_bytes_from_image(data, offset, length, bits, msb))
+
+
+def encode_stream_array(
+    pixels: np.ndarray, chunks: Iterable[bytes], length: int | None = None, *, in_place: bool = False, **codec_args: Any
+) -> np.ndarray:
+    """Encode a message given as chunks into an array of pixels, as `encode_stream` does."""
+    bits, msb = validate_args(**codec_args)
+    pixels = prepare_pixels(pixels, in_place)
+    data = flat_pixels(pixels)
+    header_length = len(encode_varint(len(data) * bits // 8 if length is None else length))
+    offset = header_length * 8
+    for chunk in chunks:
+        with span("embed"):
+            write_bytes_to_image(data, offset, chunk, bits, msb)
+        offset += len(chunk) * 8
+    written = offset // 8 - header_length
+    if length is not None and written != length:
+        msg = f"Expected a message of {length} bytes, but got {written}."
+        raise CodecError(msg)
+    write_bytes_to_image(data, 0, encode_varint(written, header_length), bits, msb)
+    return pixels
+
+
+def read_length(read_bytes: Callable[[int, int], bytes]) -> tuple[int, int]:
+    """Read the length of a message, returning it and the bit offset the message starts at.
+
+    :param read_bytes: A function to read a number of bytes from a bit offset.
+    """
     offset = 0
 
     def read_next_byte() -> int:
         nonlocal offset
-        byte = read_bytes_from_image(data, offset, length=1, bits_per_pixel=bits, msb=msb)
+        byte = read_bytes(offset, 1)
         offset += 8
         return byte[0]
 
     length = decode_varint(read_next_byte)
-    return read_bytes_from_image(data, offset, length, bits, msb)
+    return length, offset
+
+
+def parse_length(data: bytes) -> tuple[int, int]:
+    """Parse the length of a message from the bytes at its start, returning it and the number of bytes it took.
+
+    :raises CodecError: If the length runs past the end of the bytes.
+    """
+    offset = 0
+
+    def read_next_byte() -> int:
+        nonlocal offset
+        if offset >= len(data):
+            msg = "Image does not contain a message."
+            raise CodecError(msg)
+        offset += 1
+        return data[offset - 1]
+
+    length = decode_varint(read_next_byte)
+    return length, offset
+
+
+def read_message(read_bytes: Callable[[int, int], bytes]) -> bytes:
+    """Read a length prefixed message, given a function to read bytes from a bit offset."""
+    length, offset = read_length(read_bytes)
+    return read_bytes(offset, length)
+
+
+def read_message_chunks(read_bytes: Callable[[int, int], bytes], chunk_size: int) -> Iterator[bytes]:
+    """Read a length prefixed message in chunks, given a function to read bytes from a bit offset."""
+    length, offset = read_length(read_bytes)
+    # check the whole message is there before yielding any of it
+    read_bytes(offset + length * 8, 0)
+    for start in range(0, length, chunk_size):
+        yield read_bytes(offset + start * 8, min(chunk_size, length - start))
 
 
 def validate_args(**kwargs: Any) -> tuple[int, bool]:
@@ -93,34 +267,108 @@ def validate_args(**kwargs: Any) -> tuple[int, bool]:
     return bits, msb
 
 
-def iterate_bits(data: bytes) -> Iterator[int]:
-    """Iterate over the bits in a byte string."""
-    for byte in data:
-        for bit_idx in range(8):
-            yield (byte >> bit_idx) & 1
+def pixel_span(offset: int, length: int, bits_per_pixel: int) -> tuple[int, int, int]:
+    """Find the run of pixels holding a number of bytes starting at a given bit offset.
+
+    :return: The index of the first pixel, the index one past the last pixel,
+        and the number of bits to skip in the first pixel.
+    """
+    first_pixel, skip = divmod(offset, bits_per_pixel)
+    end_pixel = -(-(offset + length * 8) // bits_per_pixel)
+    return first_pixel, end_pixel, skip
 
 
-def read_bytes_from_image(image_data: bytes, offset: int, length: int, bits_per_pixel: int, msb: bool) -> bytes:
+def read_bytes_from_image(
+    image_data: bytes | np.ndarray, offset: int, length: int, bits_per_pixel: int, msb: bool
+) -> bytes:
     """Read a number of bytes from an image, starting at a given offset.
 
-    :param image_bytes: The raw bytes of the image to read from.
+    Only the bit planes holding data are extracted, from just the pixels
+    holding the requested bytes, a block at a time, so the cost is
+    proportional to ``length`` and the memory used is bounded.
+
+    :param image_data: The raw bytes of the image to read from.
     :param offset: The number of bits to skip before reading.
     :param length: The number of bytes to read.
     :param bits_per_pixel: The number of bits containing data per pixel.
     :param msb: Whether to read the most significant bits instead of the least.
     :return: The bytes read from the image.
-    :raises ValueError: If the message data would exceed the size of the image.
+    :raises CodecError: If the message data would exceed the size of the image.
     """
     if (offset + length * 8) > len(image_data) * bits_per_pixel:
         msg = "Image does not contain a message."
         raise CodecError(msg)
-    message = bytearray()
-    for bit_idx in range(offset, offset + length * 8):
-        local_bit_idx = bit_idx & 0b111
-        if local_bit_idx == 0:
-            message.append(0)
-        pixel_idx, pixel_bit = divmod(bit_idx, bits_per_pixel)
-        shift = (7 - pixel_bit) if msb else pixel_bit
-        data_bit = (image_data[pixel_idx] >> shift) & 1
-        message[-1] |= data_bit << local_bit_idx
-    return bytes(message)
+    data = np.frombuffer(image_data, dtype=np.uint8)
+    blocks = []
+    for start in range(0, length, BLOCK_SIZE):
+        size = min(BLOCK_SIZE, length - start)
+        first_pixel, end_pixel, skip = pixel_span(offset + start * 8, size, bits_per_pixel)
+        planes = extract_planes(data[first_pixel:end_pixel], bits_per_pixel, msb)
+        blocks.append(np.packbits(planes.reshape(-1)[skip : skip + size * 8], bitorder="little").tobytes())
+    return b"".join(blocks)
+
+
+def read_bytes_from_rows(rows: ImageRows, offset: int, length: int, bits_per_pixel: int, msb: bool) -> bytes:
+    """Read a number of bytes from an image, only loading the rows that hold them.
+
+    Takes the same arguments as `read_bytes_from_image`, other than the lazily
+    loaded image data.
+    """
+    if (offset + length * 8) > len(rows) * bits_per_pixel:
+        msg = "Image does not contain a message."
+        raise CodecError(msg)
+    if not length:
+        return b""
+    first_pixel, end_pixel, _ = pixel_span(offset, length, bits_per_pixel)
+    with span("load"):
+        data, start = rows.read(first_pixel, end_pixel)
+    with span("extract"):
+        return read_bytes_from_image(data, offset - start * bits_per_pixel, length, bits_per_pixel, msb)
+
+
+def write_bytes_to_image(
+    image_data: bytearray | np.ndarray, offset: int, message: bytes, bits_per_pixel: int, msb: bool
+) -> None:
+    """Write a message into an image in place, starting at a given offset.
+
+    Bits of the touched pixels which do not carry message data are preserved.
+    The message is written a block at a time, as `read_bytes_from_image` reads it.
+
+    :param image_data: The raw bytes of the image to write to.
+    :param offset: The number of bits to skip before writing.
+    :param message: The bytes to write.
+    :param bits_per_pixel: The number of bits containing data per pixel.
+    :param msb: Whether to write the most significant bits instead of the least.
+    :raises CodecError: If the message would exceed the size of the image.
+    """
+    if (offset + len(message) * 8) > len(image_data) * bits_per_pixel:
+        msg = "Message is too long to fit in image."
+        raise CodecError(msg)
+    data = np.frombuffer(image_data, dtype=np.uint8)
+    message_data = np.frombuffer(message, dtype=np.uint8)
+    positions = bit_positions(bits_per_pixel, msb)
+    mask = np.uint8(sum(1 << position for position in positions))
+    for start in range(0, len(message), BLOCK_SIZE):
+        block = message_data[start : start + BLOCK_SIZE]
+        first_pixel, end_pixel, skip = pixel_span(offset + start * 8, len(block), bits_per_pixel)
+        pixels = data[first_pixel:end_pixel]
+        # the first and last pixels may hold bits either side of the block, which are kept
+        planes = extract_planes(pixels, bits_per_pixel, msb)
+        planes.reshape(-1)[skip : skip + len(block) * 8] = np.unpackbits(block, bitorder="little")
+        merged = pixels & ~mask
+        for plane, position in enumerate(positions):
+            merged |= planes[:, plane] << position
+        pixels[:] = merged
+
+
+def bit_positions(bits_per_pixel: int, msb: bool) -> list[int]:
+    """Find which bits of each pixel hold data, in the order they are used."""
+    return [7 - plane for plane in range(bits_per_pixel)] if msb else list(range(bits_per_pixel))
+
+
+def extract_planes(pixels: np.ndarray, bits_per_pixel: int, msb: bool) -> np.ndarray:
+    """Extract just the bit planes holding data from some pixels, as an array of a row of bits for each pixel."""
+    planes = np.empty((len(pixels), bits_per_pixel), dtype=np.uint8)
+    for plane, position in enumerate(bit_positions(bits_per_pixel, msb)):
+        np.bitwise_and(pixels >> position, 1, out=planes[:, plane])
+    return planes
@@ -6,14 +6,16 @@ image containing text of your secret message. In short, it does the opposite
 of the standard LSB codec.
 """
 import textwrap
+from functools import lru_cache
 from io import BytesIO
 from math import ceil, floor
-from typing import Any
+from typing import Any, BinaryIO
 
 from PIL import Image, ImageDraw, ImageFont
 
 from . import lsb
-from .common import ASSETS
+from .common import ASSETS, Probe, SaveImage, save_png
+from .trace import span
 
 short_name = "not"
 display_name = "Not"
@@ -25,11 +27,47 @@ params = lsb.params
 encode_params = lsb.encode_params
 decode_params = lsb.decode_params
 
+# the start of the image files which could have been hidden
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"RIFF", b"II*\x00", b"MM\x00*", b"BM")
+
 
 def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image:
     """Encode an image into a message using our "not" encoding."""
+    image_io = BytesIO()
+    # images made in memory have no format, so fall back to a lossless one
+    image.save(image_io, format=image.format or "PNG")
+    return render_and_encode(image, image_io.getvalue(), message, **codec_args)
+
+
+def encode_file(
+    source: BinaryIO, target: BinaryIO, message: bytes, *, save: SaveImage = save_png, **codec_args: Any
+) -> None:
+    """Encode an image file into a message, reusing the file's bytes instead of re-saving it.
+
+    The render is saved with ``save``.
+    """
+    image = Image.open(source)  # only reads the header, which is all we need for the size
+    source.seek(0)
+    save(render_and_encode(image, source.read(), message, **codec_args), target)
+
+
+def capacity(image: Image.Image, **codec_args: Any) -> None:  # noqa: ARG001
+    """The message is rendered into an image sized to fit the original, so there is no limit on its length."""
+    return None
+
+
+def probe(image: Image.Image) -> Probe:
+    """Guess whether an image is a render hiding an image file, by looking for the start of one."""
+    for args, length, sample in lsb.probe_messages(image, max(map(len, IMAGE_SIGNATURES))):
+        if length and sample.startswith(IMAGE_SIGNATURES):
+            return Probe(0.95, args)
+    return Probe(0.0)
+
+
+def render_and_encode(image: Image.Image, image_bytes: bytes, message: bytes, **codec_args: Any) -> Image.Image:
+    """Render the message to a new image, and hide the encoded image file in it."""
     # target bytes (msg_image must be big enough)
-    num_bytes = len(bytearray(image.tobytes()))
+    num_bytes = image.width * image.height * len(image.getbands())
 
     # num_bytes / 3 for the 3 (RGB) channels in msg_image
     num_pixels = max(ceil(num_bytes / 3), 1024 * 768 * 3)  # at least (1024, 768) pixels
@@ -44,23 +82,36 @@ def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image
 
     # setup draw
     msg_image = Image.new(mode="RGB", size=(width, height), color="white")
-    font = ImageFont.truetype(font=str(ASSETS / "font.ttf"), size=font_size)
+    font = load_font(font_size)
     draw = ImageDraw.Draw(im=msg_image)
 
     # wrap text
-    avg_char_width = sum(font.font.getsize(char)[0][0] for char in set(message)) / len(set(message))
+    avg_char_width = sum(char_width(font_size, char) for char in set(message)) / len(set(message))
     max_char_count = floor((msg_image.size[0] * 0.95) / avg_char_width)
     text = textwrap.fill(text=message, width=max_char_count)
 
     # draw text
-    draw.text(xy=(width / 2, height / 2), text=text, font=font, fill=(0, 0, 0), anchor="mm")
-
-    image_io = BytesIO()
-    image.save(image_io, format=image.format)
-    image_bytes = image_io.getvalue()
+    with span("render"):
+        draw.text(xy=(width / 2, height / 2), text=text, font=font, fill=(0, 0, 0), anchor="mm")
 
     return lsb.encode(msg_image, image_bytes, **codec_args)
 
 
+@lru_cache(maxsize=32)
+def load_font(size: float) -> ImageFont.FreeTypeFont:
+    """Load our font at a given size, reusing it across requests."""
+    return ImageFont.truetype(font=str(ASSETS / "font.ttf"), size=size)
+
+
+@lru_cache(maxsize=4096)
+def char_width(size: float, char: str) -> int:
+    """Get the width of a character in our font at a given size."""
+    return load_font(size).font.getsize(char)[0][0]
+
+
 def decode(image: Image.Image, **codec_args: Any) -> bytes:  # noqa: ARG001
     return b"haha nice try"
+
+
+def decode_file(source: BinaryIO, **codec_args: Any) -> bytes:  # noqa: ARG001
+    return b"haha nice try"
@@ -0,0 +1,135 @@
+"""Encode and decode functions for sharding a message across several images.
+
+The message is split into shards, one for each cover image, sized in
+proportion to how much each cover can hold. Each shard is hidden in its
+cover with the LSB codec, behind a header giving the message it belongs to,
+its position, the number of shards and checksums of both the shard and the
+whole message. The images can then be given back in any order to get the
+message back.
+
+Unlike the other codecs, this works on many images at once, so it isn't one
+of `CODECS`. The images are encoded and decoded in parallel threads.
+"""
+import secrets
+import struct
+import zlib
+from collections.abc import Sequence
+from typing import Any
+
+from PIL import Image
+
+from . import lsb
+from .common import CodecError, map_threads
+
+MAGIC = b"SHRD"
+# magic, message ID, shard index, shard count, message CRC, shard CRC
+HEADER = struct.Struct(">4s8sHHII")
+MAX_SHARDS = 2**16 - 1
+
+
+def encode(
+    covers: Sequence[Image.Image], message: bytes, *, workers: int | None = None, **codec_args: Any
+) -> list[Image.Image]:
+    """Encode a message across some images, returning the encoded images in the same order."""
+    shards = split(message, [lsb.capacity(cover, **codec_args) for cover in covers])
+    return map_threads(
+        lambda item: lsb.encode(item[0], item[1], **codec_args), zip(covers, shards, strict=True), workers
+    )
+
+
+def decode(images: Sequence[Image.Image], *, workers: int | None = None, **codec_args: Any) -> bytes:
+    """Decode a message from all the images it was encoded across, in any order."""
+    return join(map_threads(lambda image: lsb.decode(image, **codec_args), images, workers))
+
+
+def capacity(covers: Sequence[Image.Image], **codec_args: Any) -> int:
+    """Find the length of the longest message that can be encoded across some images, from their sizes alone."""
+    return sum(shard_capacities([lsb.capacity(cover, **codec_args) for cover in covers]))
+
+
+def shard_capacities(capacities: Sequence[int]) -> list[int]:
+    """Find how much of a message each cover can hold, given how much LSB data each can, with room for headers."""
+    if not capacities:
+        msg = "At least one image is needed."
+        raise CodecError(msg)
+    if len(capacities) > MAX_SHARDS:
+        msg = f"A message can't be split across more than {MAX_SHARDS} images."
+        raise CodecError(msg)
+    for index, capacity in enumerate(capacities):
+        if capacity < HEADER.size:
+            msg = f"Image {index + 1} is too small to hold a shard."
+            raise CodecError(msg)
+    return [capacity - HEADER.size for capacity in capacities]
+
+
+def split(message: bytes, capacities: Sequence[int]) -> list[bytes]:
+    """Split a message into shards with headers, one for each cover, given how much LSB data each can hold.
+
+    Each cover gets a share of the message in proportion to its capacity, so
+    they all take about as long to encode.
+    """
+    spaces = shard_capacities(capacities)
+    total = sum(spaces)
+    if len(message) > total:
+        msg = f"Message is too long to fit in the images, which can hold {total} bytes."
+        raise CodecError(msg)
+    sizes = [len(message) * space // total for space in spaces]
+    # rounding down leaves a few bytes over, which go wherever there is room
+    remainder = len(message) - sum(sizes)
+    for index, space in enumerate(spaces):
+        extra = min(remainder, space - sizes[index])
+        sizes[index] += extra
+        remainder -= extra
+
+    message_id = secrets.token_bytes(8)
+    message_crc = zlib.crc32(message)
+    shards = []
+    offset = 0
+    for index, size in enumerate(sizes):
+        payload = message[offset : offset + size]
+        offset += size
+        fields = (MAGIC, message_id, index, len(sizes), message_crc)
+        unchecked = HEADER.pack(*fields, 0)[:-4] + payload
+        shards.append(HEADER.pack(*fields, zlib.crc32(unchecked)) + payload)
+    return shards
+
+
+def join(shards: Sequence[bytes]) -> bytes:
+    """Put a message back together from its shards, in any order.
+
+    :raises CodecError: If any shard is damaged, is from another message, or is missing.
+    """
+    if not shards:
+        msg = "At least one image is needed."
+        raise CodecError(msg)
+    parts: dict[int, bytes] = {}
+    expected = None
+    for number, shard in enumerate(shards, 1):
+        if len(shard) < HEADER.size:
+            msg = f"Image {number} does not contain a shard."
+            raise CodecError(msg)
+        magic, message_id, index, count, message_crc, shard_crc = HEADER.unpack_from(shard)
+        if magic != MAGIC:
+            msg = f"Image {number} does not contain a shard."
+            raise CodecError(msg)
+        if zlib.crc32(shard[: HEADER.size - 4] + shard[HEADER.size :]) != shard_crc:
+            msg = f"The shard in image {number} is damaged."
+            raise CodecError(msg)
+        if expected is None:
+            expected = (message_id, count, message_crc)
+        elif (message_id, count, message_crc) != expected:
+            msg = f"Image {number} holds a shard of a different message."
+            raise CodecError(msg)
+        # the same image given twice is harmless
+        parts[index] = shard[HEADER.size :]
+
+    _, count, message_crc = expected
+    missing = [str(index + 1) for index in range(count) if index not in parts]
+    if missing:
+        msg = f"Missing shard {', '.join(missing)} of {count}."
+        raise CodecError(msg)
+    message = b"".join(parts[index] for index in range(count))
+    if zlib.crc32(message) != message_crc:
+        msg = "The message put together from the shards is damaged."
+        raise CodecError(msg)
+    return message
@@ -1,14 +1,35 @@
 """Encode and decode functions for the seed-spaced data bytes codec
 
 It works by spacing the message apart by random distances generated from
-the entered password"""
-from hashlib import sha256
-from random import randint, seed
+the entered password.
+
+The positions are a pseudorandom permutation of the image's byte indices,
+keyed by the password, so the position of any bit of the message can be
+computed directly. Images encoded with the original scheme, which drew
+positions from a seeded random number generator, can still be handled by
+passing the legacy flag."""
+from collections.abc import Iterator
+from hashlib import sha256, sha512
+from random import Random
 from typing import Any
 
+import numpy as np
 from PIL import Image
 
-from .common import CodecError, CodecParam, decode_varint, encode_varint
+from .common import (
+    CodecError,
+    CodecParam,
+    Probe,
+    array_to_image,
+    decode_varint,
+    encode_varint,
+    flat_pixels,
+    image_to_array,
+    max_message_length,
+    prepare_pixels,
+    raw_size,
+)
+from .trace import span
 
 short_name = "ssdb"
 display_name = "SSDB"
@@ -25,6 +46,15 @@ params = [
         help_="The password used to encode/decode.",
         cli_flag="pwd",
     ),
+    CodecParam(
+        name="legacy",
+        type_=bool,
+        default=False,
+        required=False,
+        display_name="Legacy",
+        help_="use the original random position scheme",
+        cli_flag="legacy",
+    ),
 ]
 encode_params = []
 decode_params = []
@@ -32,9 +62,134 @@ decode_params = []
 
 def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image:
     """Encode data by the format described above."""
-    image_data = bytearray(image.tobytes())
+    pixels = encode_array(image_to_array(image), image.mode, message, in_place=True, **codec_args)
+    return array_to_image(pixels, image.mode, image.size)
+
+
+def decode(image: Image.Image, **codec_args: Any) -> bytes:
+    """Decode data by the format described above.
+
+    As it just reads out the data there is no check that the data is correct."""
+    return decode_array(image_to_array(image, writable=False), image.mode, **codec_args)
+
+
+def capacity(image: Image.Image, *, legacy: bool = False, **codec_args: Any) -> int:  # noqa: ARG001
+    """Find the length of the longest message that can be encoded into an image, from its size alone."""
+    # the password doesn't matter, as every byte of the image holds one bit,
+    # or only half of them with the legacy scheme
+    return max_message_length(raw_size(image) // (16 if legacy else 8))
+
+
+def probe(image: Image.Image) -> Probe:  # noqa: ARG001
+    """Messages are scattered by the password, so without it there is nothing to find."""
+    return Probe(0.0)
+
+
+def encode_array(
+    pixels: np.ndarray, mode: str, message: bytes, *, in_place: bool = False, **codec_args: Any  # noqa: ARG001
+) -> np.ndarray:
+    """Encode data into an array of pixels by the format described above."""
     data = encode_varint(len(message)) + message
-    password = validate_args(**codec_args)
+    password, legacy = validate_args(**codec_args)
+    if not legacy and pixels.size < len(data) * 8:
+        msg = "Data is to long to be encoded into this image."
+        raise CodecError(msg)
+    pixels = prepare_pixels(pixels, in_place)
+    image_data = flat_pixels(pixels)
+    if legacy:
+        with span("embed"):
+            legacy_encode(image_data, data, password)
+        return pixels
+
+    with span("positions"):
+        positions = KeyedPermutation(len(image_data), password)[np.arange(len(data) * 8)]
+    with span("embed"):
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little")
+        image_data[positions] = (image_data[positions] & 0b1111_1110) | bits
+
+    return pixels
+
+
+def decode_array(pixels: np.ndarray, mode: str, **codec_args: Any) -> bytes:  # noqa: ARG001
+    """Decode data from an array of pixels by the format described above."""
+    image_data = flat_pixels(pixels)
+    password, legacy = validate_args(**codec_args)
+    if legacy:
+        with span("extract"):
+            return legacy_decode(image_data, password)
+
+    permutation = KeyedPermutation(len(image_data), password)
+    offset = 0
+
+    def read_bytes(length: int) -> bytes:
+        nonlocal offset
+        if offset + length * 8 > len(image_data):
+            msg = "Image does not contain a message."
+            raise CodecError(msg)
+        with span("positions"):
+            positions = permutation[np.arange(offset, offset + length * 8)]
+        offset += length * 8
+        with span("extract"):
+            return np.packbits(image_data[positions] & 1, bitorder="little").tobytes()
+
+    length = decode_varint(lambda: read_bytes(1)[0])
+    return read_bytes(length)
+
+
+class KeyedPermutation:
+    """A pseudorandom permutation of ``range(size)``, keyed by a password.
+
+    This is a Feistel network over the smallest number of bits covering
+    ``size``, with cycle walking to bring values outside the range back into
+    it. Any element can be computed independently of the others, and whole
+    arrays of indices are mapped at once.
+    """
+
+    ROUNDS = 8
+
+    def __init__(self, size: int, password: str):
+        self.size = size
+        total_bits = max(2, (size - 1).bit_length())
+        self.low_bits = np.uint64(total_bits // 2)
+        self.low_mask = np.uint64((1 << (total_bits // 2)) - 1)
+        self.high_mask = np.uint64((1 << (total_bits - total_bits // 2)) - 1)
+        key = sha512(b"ssdb-permutation:" + password.encode("UTF-8")).digest()
+        self.round_keys = np.frombuffer(key, dtype="<u8")[: self.ROUNDS]
+
+    def __getitem__(self, indices: np.ndarray) -> np.ndarray:
+        """Find the positions the given indices are mapped to."""
+        positions = self.feistel(np.asarray(indices, dtype=np.uint64))
+        out_of_range = positions >= self.size
+        while out_of_range.any():
+            positions[out_of_range] = self.feistel(positions[out_of_range])
+            out_of_range = positions >= self.size
+        return positions.astype(np.intp)
+
+    def feistel(self, values: np.ndarray) -> np.ndarray:
+        """Apply one pass of the Feistel network, which permutes the whole bit range.
+
+        The halves may differ in size by a bit, so rather than swapping them
+        each round alternately scrambles one half using the other.
+        """
+        high = values >> self.low_bits
+        low = values & self.low_mask
+        for round_idx, round_key in enumerate(self.round_keys):
+            if round_idx % 2:
+                low ^= mix(high ^ round_key) & self.low_mask
+            else:
+                high ^= mix(low ^ round_key) & self.high_mask
+        return (high << self.low_bits) | low
+
+
+def mix(values: np.ndarray) -> np.ndarray:
+    """Scramble 64 bit integers (the splitmix64 finaliser)."""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def legacy_encode(image_data: np.ndarray, data: bytes, password: str) -> None:
+    """Encode data using the original random position scheme."""
     seed_hash = generate_seed(password)  # hash the password
 
     if (
@@ -52,15 +207,9 @@ def encode(image: Image.Image, message: bytes, **codec_args: Any) -> Image.Image
         location, byte = next(byte_gen)
         image_data[location] = set_lsb(byte, bit)
 
-    return Image.frombytes(image.mode, image.size, image_data)
 
-
-def decode(image: Image.Image, **codec_args: Any) -> bytes:
-    """Decode data by the format described above.
-
-    As it just reads out the data there is no check that the data is correct."""
-    image_data = bytearray(image.tobytes())
-    password = validate_args(**codec_args)
+def legacy_decode(image_data: np.ndarray, password: str) -> bytes:
+    """Decode data using the original random position scheme."""
     seed_hash = generate_seed(password)  # hash the password
 
     byte_gen = byte_generator(image_data, seed_hash)
@@ -82,30 +231,30 @@ def decode(image: Image.Image, **codec_args: Any) -> bytes:
     length = decode_varint(read_next_byte)
 
     # assemble message
-    message = b""
+    message = bytearray()
     for _ in range(length):
-        message += read_next_byte().to_bytes(1, "big")
+        message.append(read_next_byte())
 
-    return message
+    return bytes(message)
 
 
 MAX_REPEATS = 100
 
 
-def byte_generator(image_data: bytearray, seed_hash: str) -> tuple[int, bytes]:
+def byte_generator(image_data: np.ndarray, seed_hash: str) -> Iterator[tuple[int, int]]:
     """Generator for the location and the value of bytes in the image.
 
     It ensures that each pixel is only written to once."""
 
-    seed(seed_hash)  # set seed to enusre the same randum numbers
+    rng = Random(seed_hash)  # a private generator, so that concurrent calls don't interfere
     max_step = len(image_data) - 1
-    previous = []
+    previous = set()
     repeat = 0
     while True:
-        random_number = randint(0, max_step)  # noqa: S311
+        random_number = rng.randint(0, max_step)
         # in theory you would need crypto but i did not find a lib with the correct tools
         if random_number not in previous:
-            previous.append(random_number)
+            previous.add(random_number)
             cursor = random_number
             repeat = 0
             yield cursor, image_data[cursor]
@@ -119,16 +268,17 @@ def byte_generator(image_data: bytearray, seed_hash: str) -> tuple[int, bytes]:
                 raise CodecError(msg)
 
 
-def validate_args(**kwargs: Any) -> str:
+def validate_args(**kwargs: Any) -> tuple[str, bool]:
     """Validate the arguments passed to the codec."""
     password = kwargs.pop("password")
+    legacy = kwargs.pop("legacy", False)
     if kwargs:
         msg = f"Unexpected arguments: {', '.join(kwargs)}"
         raise TypeError(msg)
     if password is None:
         msg = "A password is required."
         raise CodecError(msg)
-    return password
+    return password, legacy
 
 
 def get_bits(data: bytes) -> list[int]:
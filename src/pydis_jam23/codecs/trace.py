@@ -0,0 +1,91 @@
+"""Lightweight timing of the stages of encoding and decoding.
+
+Stages are wrapped in `span`, which does nothing unless a `Trace` has been
+activated in the current context (see `tracing`), so it is cheap enough to
+leave in place. Repeated stages are added together.
+
+    with trace.tracing() as timings:
+        lsb.encode(image, message, bits=1, msb=False)
+    print(timings.breakdown())
+"""
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+
+
+class Trace:
+    """The total time spent in, and number of calls to, each stage.
+
+    Stages run in several threads at once are added together, so they can
+    add up to more than the time taken overall.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+
+    def as_dict(self) -> dict[str, dict[str, float]]:
+        """Get the stages in the order they first ran, with their call counts and total milliseconds."""
+        return {name: {"calls": calls, "ms": seconds * 1000} for name, (calls, seconds) in self.stages.items()}
+
+    def breakdown(self) -> str:
+        """Describe the stages, one per line."""
+        width = max((len(name) for name in self.stages), default=0)
+        lines = []
+        for name, (calls, seconds) in self.stages.items():
+            repeats = f" ({calls} calls)" if calls > 1 else ""
+            lines.append(f"{name:<{width}} {seconds * 1000:9.2f} ms{repeats}")
+        return "\n".join(lines)
+
+    def server_timing(self) -> str:
+        """Format the stages as a ``Server-Timing`` header."""
+        return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, (_, seconds) in self.stages.items())
+
+
+_current: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def activate(trace: Trace) -> Token:
+    """Record spans in the current context to a trace, until `deactivate` is called with the token returned."""
+    return _current.set(trace)
+
+
+def deactivate(token: Token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def tracing() -> Iterator[Trace]:
+    """Record the spans run inside the block."""
+    trace = Trace()
+    token = activate(trace)
+    try:
+        yield trace
+    finally:
+        deactivate(token)
+
+
+class span:  # noqa: N801 - used like a function
+    """Time a stage, if tracing is active."""
+
+    __slots__ = ("name", "trace", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        if self.trace is not None:
+            self.trace.add(self.name, time.perf_counter() - self.start)
@@ -0,0 +1,217 @@
+"""A queue of encode and decode jobs, run in a pool of worker processes.
+
+This lets the web app hand off slow codecs without holding up its requests.
+Only a limited number of jobs can be waiting at once, beyond which new ones
+are refused, so clients have to back off rather than piling work up. Jobs can
+be cancelled, though once a job has started its result is just thrown away,
+as a worker process can't be interrupted part way through a job.
+"""
+import io
+import multiprocessing
+import secrets
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+from .codecs import CODECS, ArrayCodec, Codec, CodecError, FileCodec, detect
+from .codecs.common import array_to_image
+
+
+class QueueFullError(Exception):
+    """Too many jobs are waiting to take any more."""
+
+
+@dataclass
+class EncodedFile:
+    """An encoded image file, as the codec wrote it, so nothing it appended is lost by decoding it."""
+
+    data: bytes
+
+
+@dataclass
+class Job:
+    job_id: str
+    owner: str
+    description: str
+    future: Future
+    submitted: float = field(default_factory=time.monotonic)
+    finished: float | None = None
+    cancelled: bool = False
+    result: Any = None
+    error: str | None = None
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return "cancelled"
+        if self.finished is not None:
+            return "failed" if self.error is not None else "done"
+        return "running" if self.future.running() else "queued"
+
+
+class JobQueue:
+    """Jobs run in a pool of processes, which is started when the first job is submitted.
+
+    :param max_workers: The number of worker processes.
+    :param max_pending: The most jobs which can be queued or running at once.
+    :param keep_finished: How many seconds to keep finished jobs around for, so their results can be collected.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, keep_finished: float = 10 * 60):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self._jobs: dict[str, Job] = {}
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        owner: str,
+        description: str,
+        function: Callable[..., Any],
+        *args: Any,
+        on_done: Callable[[Any], None] | None = None,
+    ) -> Job:
+        """Queue a call to a function in a worker process, which must be able to pickle it and its arguments.
+
+        ``on_done`` is called with the result once the job has finished, unless
+        it failed or was cancelled, to do anything needed with it.
+
+        :raises QueueFullError: If there are already ``max_pending`` jobs waiting or running.
+        """
+        with self._lock:
+            self._purge()
+            # cancelled jobs which have started still hold up a worker, so count too
+            pending = sum(1 for job in self._jobs.values() if job.finished is None)
+            if pending >= self.max_pending:
+                msg = f"There are already {pending} jobs waiting, try again later."
+                raise QueueFullError(msg)
+            try:
+                future = self._start_pool().submit(function, *args)
+            except BrokenProcessPool:
+                # a worker died (killed for using too much memory, say), so start a new pool
+                self._pool = None
+                future = self._start_pool().submit(function, *args)
+            job = Job(job_id=secrets.token_urlsafe(12), owner=owner, description=description, future=future)
+            self._jobs[job.job_id] = job
+        job.future.add_done_callback(lambda future: self._finish(job, future, on_done))
+        return job
+
+    def get(self, job_id: str, owner: str) -> Job | None:
+        """Get a job, if it exists and belongs to the given owner."""
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        return job if job is not None and job.owner == owner else None
+
+    def position(self, job: Job) -> int:
+        """Find how many queued jobs are ahead of a job."""
+        with self._lock:
+            return sum(
+                1
+                for other in self._jobs.values()
+                if other.submitted < job.submitted and other.status == "queued" and other is not job
+            )
+
+    def cancel(self, job: Job) -> None:
+        """Cancel a job, dropping it from the queue if it hasn't started, or ignoring its result otherwise."""
+        with self._lock:
+            if job.finished is None:
+                job.cancelled = True
+                job.future.cancel()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # forking a threaded server isn't safe, so start the workers afresh
+            context = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        return self._pool
+
+    def _finish(self, job: Job, future: Future, on_done: Callable[[Any], None] | None) -> None:
+        try:
+            result = None if future.cancelled() else future.result()
+            if not job.cancelled:
+                job.result = result
+                if on_done is not None:
+                    on_done(result)
+        except (CodecError, TypeError, ValueError) as e:
+            job.error = str(e)
+        except Exception as e:
+            # report anything else going wrong in a worker too, rather than leaving the job pending
+            job.error = f"The job failed unexpectedly: {type(e).__name__}"
+        finally:
+            job.finished = time.monotonic()
+
+    def _purge(self) -> None:
+        deadline = time.monotonic() - self.keep_finished
+        expired = [job.job_id for job in self._jobs.values() if job.finished is not None and job.finished < deadline]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def encode_job(
+    codec_name: str, pixels: np.ndarray, mode: str, size: tuple[int, int], message: bytes, args: dict[str, Any]
+) -> np.ndarray | Image.Image:
+    """Encode a message into an image's pixels, in a worker process."""
+    codec = find_codec(codec_name)
+    if isinstance(codec, ArrayCodec):
+        return codec.encode_array(pixels, mode, message, **args)
+    return codec.encode(array_to_image(pixels, mode, size), message, **args)
+
+
+def decode_job(codec_name: str, pixels: np.ndarray, mode: str, size: tuple[int, int], args: dict[str, Any]) -> bytes:
+    """Decode a message from an image's pixels, in a worker process."""
+    codec = find_codec(codec_name)
+    if isinstance(codec, ArrayCodec):
+        return codec.decode_array(pixels, mode, **args)
+    return codec.decode(array_to_image(pixels, mode, size), **args)
+
+
+def encode_file_job(codec_name: str, source: bytes, message: bytes, args: dict[str, Any]) -> EncodedFile:
+    """Encode a message into an image file, for codecs which need the file itself, in a worker process."""
+    codec = find_file_codec(codec_name)
+    target = io.BytesIO()
+    codec.encode_file(io.BytesIO(source), target, message, **args)
+    return EncodedFile(target.getvalue())
+
+
+def decode_file_job(codec_name: str, source: bytes, args: dict[str, Any]) -> bytes:
+    """Decode a message from an image file, for codecs which need the file itself, in a worker process."""
+    codec = find_file_codec(codec_name)
+    return codec.decode_file(io.BytesIO(source), **args)
+
+
+def detect_job(pixels: np.ndarray, mode: str, size: tuple[int, int], force: bool) -> tuple[str, bytes]:
+    """Decode a message from an image's pixels with whichever codec most likely hid it, in a worker process.
+
+    :return: A description of the codec used, and the message.
+    """
+    # rebuilt from the pixels, as some codecs draw on the image they decode
+    candidate, message = detect.decode(array_to_image(pixels, mode, size), force=force)
+    return candidate.describe(), message
+
+
+def find_codec(short_name: str) -> Codec:
+    return next(codec for codec in CODECS if codec.short_name == short_name)
+
+
+def find_file_codec(short_name: str) -> FileCodec:
+    codec = find_codec(short_name)
+    if not isinstance(codec, FileCodec):
+        msg = f"{codec.display_name} doesn't work on image files."
+        raise CodecError(msg)
+    return codec
@@ -0,0 +1,102 @@
+"""Options for how encoded images are saved.
+
+PNG's zlib compression can take longer than hiding the message itself for
+large images, so the compression level can be turned down, or an
+uncompressed lossless format used instead, trading file size for speed.
+"""
+import time
+import typing
+from dataclasses import dataclass
+
+from PIL import Image
+
+from .codecs import CodecError
+from .codecs.trace import span
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    pillow_format: str
+    mimetype: str
+    extension: str
+    save_args: dict[str, typing.Any]
+
+
+FORMATS = {
+    "png": OutputFormat("PNG", "image/png", ".png", {}),
+    "bmp": OutputFormat("BMP", "image/bmp", ".bmp", {}),
+    "ppm": OutputFormat("PPM", "image/x-portable-pixmap", ".ppm", {}),
+    "tiff": OutputFormat("TIFF", "image/tiff", ".tiff", {"compression": "raw"}),
+}
+DEFAULT_COMPRESS_LEVEL = 6
+# lossy formats, only for previews, as they would destroy any hidden message
+PREVIEW_FORMATS = {
+    "jpeg": OutputFormat("JPEG", "image/jpeg", ".jpg", {"quality": 80}),
+    "webp": OutputFormat("WEBP", "image/webp", ".webp", {"quality": 80, "method": 2}),
+}
+DEFAULT_PREVIEW_SIZE = 1600
+MAX_PREVIEW_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    format_: str = "png"
+    compress_level: int = DEFAULT_COMPRESS_LEVEL
+    optimize: bool = False
+
+    @property
+    def format_info(self) -> OutputFormat:
+        return FORMATS[self.format_]
+
+    def describe(self) -> str:
+        """Describe the options, for reporting timings."""
+        if self.format_ != "png":
+            return self.format_info.pillow_format
+        return f"PNG (level {self.compress_level}{', optimized' if self.optimize else ''})"
+
+
+def save_image(image: Image.Image, file: typing.BinaryIO, options: OutputOptions) -> float:
+    """Save an image with the given options, returning the time it took in seconds."""
+    start = time.perf_counter()
+    output_format = options.format_info
+    save_args = dict(output_format.save_args)
+    if output_format.pillow_format == "PNG":
+        save_args.update(compress_level=options.compress_level, optimize=options.optimize)
+    try:
+        with span("save"):
+            image.save(file, format=output_format.pillow_format, **save_args)
+    except (OSError, ValueError) as e:
+        msg = f"Can't save a {image.mode} image as {output_format.pillow_format}: {e}"
+        raise CodecError(msg) from e
+    return time.perf_counter() - start
+
+
+@dataclass(frozen=True)
+class PreviewOptions:
+    """A downscaled copy of an image, fitting within the given bounds, for showing it rather than saving it."""
+
+    format_: str = "jpeg"
+    max_width: int = DEFAULT_PREVIEW_SIZE
+    max_height: int = DEFAULT_PREVIEW_SIZE
+
+    @property
+    def format_info(self) -> OutputFormat:
+        return PREVIEW_FORMATS[self.format_]
+
+
+def save_preview(image: Image.Image, file: typing.BinaryIO, options: PreviewOptions) -> None:
+    """Save a preview of an image, never scaling it up."""
+    scale = min(options.max_width / image.width, options.max_height / image.height, 1)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    transparent = "A" in image.getbands() or "transparency" in image.info
+    mode = "RGBA" if transparent and options.format_ == "webp" else "RGB"
+    with span("preview"):
+        # scale first where possible, so there are fewer pixels to convert
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert(mode)
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+        if image.mode != mode:
+            image = image.convert(mode)
+    with span("save"):
+        image.save(file, format=options.format_info.pillow_format, **options.format_info.save_args)
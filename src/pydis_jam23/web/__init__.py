@@ -1,18 +1,79 @@
+import functools
 import io
+import itertools
+import os
+import secrets
+import time
 import webbrowser
-from typing import Any
+from collections.abc import Callable, Iterable, Mapping
+from typing import Any, BinaryIO
 
-from flask import Flask, flash, render_template, request, send_file
-from PIL import Image
+import numpy as np
+from flask import Flask, Response, abort, flash, g, render_template, request, send_file, session, stream_with_context
+from PIL import Image, UnidentifiedImageError
+from werkzeug.http import is_resource_modified
+
+from pydis_jam23.codecs import (
+    CODECS,
+    ArrayCodec,
+    Codec,
+    CodecError,
+    CodecParam,
+    FileCodec,
+    StreamCodec,
+    concat,
+    detect,
+    edges,
+    lsb,
+    notlsb,
+)
+from pydis_jam23.codecs.trace import Trace, activate, deactivate, span
+from pydis_jam23.jobs import (
+    EncodedFile,
+    Job,
+    JobQueue,
+    QueueFullError,
+    decode_file_job,
+    decode_job,
+    detect_job,
+    encode_file_job,
+    encode_job,
+)
+from pydis_jam23.output import (
+    DEFAULT_COMPRESS_LEVEL,
+    DEFAULT_PREVIEW_SIZE,
+    FORMATS,
+    MAX_PREVIEW_SIZE,
+    PREVIEW_FORMATS,
+    OutputOptions,
+    PreviewOptions,
+    save_image,
+    save_preview,
+)
+
+from .store import ImageStore, ImageTooLargeError, StoredImage
+
+
+class CodecNotFoundError(ValueError):
+    pass
 
-from pydis_jam23.codecs import CODECS, Codec, CodecError, CodecParam
 
 app = Flask(__name__)
-app.secret_key = "secret"  # We're only running locally.
+app.secret_key = os.environ.get("STEGO_SECRET_KEY") or secrets.token_hex()
+# uploads bigger than these are refused before being read, or before being decoded
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("STEGO_MAX_UPLOAD_BYTES", 64 * 2**20))
+MAX_PIXELS = int(float(os.environ.get("STEGO_MAX_MEGAPIXELS", 100)) * 1_000_000)
 
-# Yep, it's a global mutable variable. It *should* work fine though since
-# there's only one user.
-current_image: Image.Image | None = None
+# each session's current image, with its pixels ready for the codecs
+images = ImageStore(
+    max_bytes=int(os.environ.get("STEGO_STORE_MAX_BYTES", 1024 * 2**20)),
+    ttl=float(os.environ.get("STEGO_STORE_TTL", 60 * 60)),
+)
+# encoding and decoding in the background, for big images and slow codecs
+jobs = JobQueue(
+    max_workers=int(os.environ.get("STEGO_JOB_WORKERS", os.cpu_count() or 1)),
+    max_pending=int(os.environ.get("STEGO_JOB_QUEUE", 16)),
+)
 
 
 def run_server():
@@ -20,6 +81,28 @@ def run_server():
     app.run()
 
 
+@app.before_request
+def start_trace():
+    g.trace = Trace()
+    g.trace_token = activate(g.trace)
+
+
+@app.after_request
+def add_server_timing(response: Response) -> Response:
+    """Report how long each stage of handling the request took."""
+    if g.trace.stages:
+        response.headers["Server-Timing"] = g.trace.server_timing()
+    return response
+
+
+@app.teardown_request
+def stop_trace(_: BaseException | None) -> None:
+    # contexts pushed without handling a request (by tests, say) never started one
+    token = g.pop("trace_token", None)
+    if token is not None:
+        deactivate(token)
+
+
 @app.route("/")
 def index():
     return render("index.j2")
@@ -37,17 +120,20 @@ def get_encode(codec: str):
 
 @app.route("/encode/<codec>", methods=["POST"])
 def post_encode(codec: str):
-    global current_image  # noqa: PLW0603 - global mutable
-    if current_image is None:
-        msg = "No image loaded"
-        raise ValueError(msg)
+    current = require_image()
     codec_obj = find_codec(codec)
     message = request.form["message"].encode("utf-8")
     extra_args = get_args(codec_obj.params + codec_obj.encode_params)
     try:
-        current_image = codec_obj.encode(current_image, message, **extra_args)
-        print(current_image)
-    except CodecError as e:
+        if uses_file(codec_obj, extra_args, current):
+            encoded = stored_file(encode_file_job(codec, current_file(current), message, extra_args).data)
+        elif isinstance(codec_obj, ArrayCodec):
+            pixels = codec_obj.encode_array(current.pixels, current.image.mode, message, **extra_args)
+            encoded = StoredImage.from_pixels(pixels, current)
+        else:
+            encoded = StoredImage.from_image(codec_obj.encode(current.load(), message, **extra_args))
+        images.put(session_key(), encoded)
+    except (CodecError, ImageTooLargeError) as e:
         flash(f"Encoding failed: {e}")
     return render("action.j2", codec=codec_obj, encode=True)
 
@@ -59,62 +145,543 @@ def get_decode(codec: str):
 
 @app.post("/decode/<codec>")
 def post_decode(codec: str):
-    if current_image is None:
-        msg = "No image loaded"
-        raise ValueError(msg)
+    current = require_image()
     codec_obj = find_codec(codec)
     extra_args = get_args(codec_obj.params + codec_obj.decode_params)
     try:
-        message = codec_obj.decode(current_image, **extra_args).decode("utf-8")
+        if uses_file(codec_obj, extra_args, current):
+            # the message is read from the end of the file, not the pixels, so isn't drawn on them
+            decoded = decode_file_job(codec, current_file(current), extra_args)
+        else:
+            if isinstance(codec_obj, ArrayCodec):
+                decoded = codec_obj.decode_array(current.pixels, current.image.mode, **extra_args)
+            else:
+                decoded = codec_obj.decode(current.load(), **extra_args)
+            show_decoded(session_key(), current, codec_obj, decoded)
+        message = decoded.decode("utf-8")
     except (CodecError, UnicodeDecodeError) as e:
         message = None
         flash(f"Decoding failed: {e}")
     return render("action.j2", codec=codec_obj, encode=False, decoded_message=message)
 
 
+@app.get("/detect")
+def get_detect():
+    return render("detect.j2")
+
+
+@app.post("/detect")
+def post_detect():
+    """Decode a message from the current image without being told the codec, by detecting it."""
+    current = require_image()
+    force = bool(request.form.get("force"))
+    try:
+        codec_description, decoded = detect_job(current.pixels, current.image.mode, current.image.size, force)
+        message = decoded.decode("utf-8")
+    except (CodecError, UnicodeDecodeError) as e:
+        codec_description = message = None
+        flash(f"Decoding failed: {e}")
+    return render("detect.j2", decoded_message=message, codec_description=codec_description)
+
+
+@app.post("/jobs/encode/<codec>")
+def post_encode_job(codec: str):
+    """Start encoding a message into the current image in the background, as the encode form would."""
+    current = require_image()
+    codec_obj = find_codec(codec)
+    message = request.form["message"].encode("utf-8")
+    extra_args = get_args(codec_obj.params + codec_obj.encode_params)
+    key = session_key()
+
+    def store_result(result: np.ndarray | Image.Image | EncodedFile) -> None:
+        if isinstance(result, EncodedFile):
+            encoded = stored_file(result.data)
+        elif isinstance(result, Image.Image):
+            encoded = StoredImage.from_image(result)
+        else:
+            encoded = StoredImage.from_pixels(result, current)
+        # the image might have been replaced while the job was running
+        if not images.replace(key, current, encoded):
+            msg = "The image was changed while encoding it."
+            raise ValueError(msg)
+
+    description = f"{codec_obj.display_name} encode"
+    if uses_file(codec_obj, extra_args, current):
+        args = (codec, current_file(current), message, extra_args)
+        return submit_job(key, description, encode_file_job, args, store_result)
+    args = (codec, current.pixels, current.image.mode, current.image.size, message, extra_args)
+    return submit_job(key, description, encode_job, args, store_result)
+
+
+@app.post("/jobs/decode/<codec>")
+def post_decode_job(codec: str):
+    """Start decoding a message from the current image in the background, as the decode form would."""
+    current = require_image()
+    codec_obj = find_codec(codec)
+    extra_args = get_args(codec_obj.params + codec_obj.decode_params)
+    key = session_key()
+
+    def store_result(decoded: bytes) -> None:
+        show_decoded(key, current, codec_obj, decoded)
+
+    description = f"{codec_obj.display_name} decode"
+    if uses_file(codec_obj, extra_args, current):
+        # as for the decode form, the message in a trailer isn't drawn on the image
+        return submit_job(key, description, decode_file_job, (codec, current_file(current), extra_args))
+    args = (codec, current.pixels, current.image.mode, current.image.size, extra_args)
+    return submit_job(key, description, decode_job, args, store_result)
+
+
+@app.post("/jobs/detect")
+def post_detect_job():
+    """Start detecting the codec of, and decoding, a message in the current image in the background."""
+    current = require_image()
+    args = (current.pixels, current.image.mode, current.image.size, bool(request.form.get("force")))
+    return submit_job(session_key(), "Detect and decode", detect_job, args)
+
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+    """Report how a job is getting on, and its decoded message once finished."""
+    job = find_job(job_id)
+    return job_info(job)
+
+
+@app.delete("/jobs/<job_id>")
+def delete_job(job_id: str):
+    job = find_job(job_id)
+    jobs.cancel(job)
+    return job_info(job)
+
+
+# a stateless API for other programs, which takes everything it needs in each request
+API_PREFIX = "/api/v1"
+API_CHUNK_SIZE = 2**16
+
+
+@app.post(f"{API_PREFIX}/encode/<codec>")
+def api_encode(codec: str):
+    """Encode a message into an image, responding with the encoded image.
+
+    The image is either the whole request body, with the message given as the
+    ``message`` query parameter, or the ``image`` part of a multipart form,
+    with the message (which may be binary) as its ``message`` part. Codec
+    parameters and output options are given as query parameters.
+    """
+    try:
+        codec_obj = find_codec(codec)
+        extra_args = get_query_args(codec_obj.params + codec_obj.encode_params)
+        output = get_output_options()
+        source = get_api_image()
+        message = get_api_message()
+        target = io.BytesIO()
+        if isinstance(codec_obj, FileCodec):
+            codec_obj.encode_file(
+                source, target, message, save=functools.partial(save_image, options=output), **extra_args
+            )
+            # these may pass the file through in the format they were given
+            target.seek(0)
+            with Image.open(target) as encoded:
+                mimetype = Image.MIME.get(encoded.format or "", "application/octet-stream")
+        else:
+            image = codec_obj.encode(open_image(source), message, **extra_args)
+            save_image(image, target, output)
+            mimetype = output.format_info.mimetype
+    except CodecNotFoundError as e:
+        return {"error": str(e)}, 404
+    except ImageTooLargeError as e:
+        return {"error": str(e)}, 413
+    except UnidentifiedImageError as e:
+        return {"error": str(e)}, 415
+    except (CodecError, ValueError) as e:
+        return {"error": str(e)}, 400
+    target.seek(0)
+    return send_file(target, mimetype=mimetype)
+
+
+@app.post(f"{API_PREFIX}/decode/<codec>")
+def api_decode(codec: str):
+    """Decode a message from an image, responding with its raw bytes.
+
+    The image is given as for encoding. Codecs which can decode in chunks
+    stream the message out as it is decoded.
+    """
+    try:
+        codec_obj = find_codec(codec)
+        extra_args = get_query_args(codec_obj.params + codec_obj.decode_params)
+        source = get_api_image()
+        if isinstance(codec_obj, StreamCodec) and not isinstance(codec_obj, FileCodec):
+            image = open_upload(source)
+            chunks = iter(codec_obj.decode_stream(image, chunk_size=API_CHUNK_SIZE, **extra_args))
+            # decode the first chunk now, so a bad image is still reported as an error response
+            body: Iterable[bytes] = itertools.chain([next(chunks, b"")], chunks)
+        elif isinstance(codec_obj, FileCodec):
+            body = [codec_obj.decode_file(source, **extra_args)]
+        else:
+            body = [codec_obj.decode(open_image(source), **extra_args)]
+    except CodecNotFoundError as e:
+        return {"error": str(e)}, 404
+    except ImageTooLargeError as e:
+        return {"error": str(e)}, 413
+    except UnidentifiedImageError as e:
+        return {"error": str(e)}, 415
+    except (CodecError, ValueError) as e:
+        return {"error": str(e)}, 400
+    return Response(stream_with_context(body), mimetype="application/octet-stream")
+
+
+@app.post(f"{API_PREFIX}/detect")
+def api_detect():
+    """Decode a message from an image without being told the codec, responding with its raw bytes.
+
+    The image is given as for decoding, and the codec found is described in
+    the ``X-Stego-Codec`` header. If nothing found looks like a message, the
+    response is 422, unless ``force`` is given.
+    """
+    try:
+        force = parse_flag(request.args.get("force", "false"))
+        candidate, message = detect.decode(open_image(get_api_image()), force=force)
+    except detect.NoMessageError as e:
+        return {"error": str(e)}, 422
+    except ImageTooLargeError as e:
+        return {"error": str(e)}, 413
+    except UnidentifiedImageError as e:
+        return {"error": str(e)}, 415
+    except (CodecError, ValueError) as e:
+        return {"error": str(e)}, 400
+    return Response(message, mimetype="application/octet-stream", headers={"X-Stego-Codec": candidate.describe()})
+
+
+@app.get("/capacity/<codec>")
+def get_capacity(codec: str):
+    """Report how much the current image can hold, and the fewest LSB bits fitting a message ``length`` bytes long."""
+    current = require_image()
+    codec_obj = find_codec(codec)
+    params = [param for param in codec_obj.params + codec_obj.encode_params if not param.required]
+    try:
+        if codec_obj is edges:
+            # the only codec needing the pixels, to find the edges
+            capacity = edges.capacity_array(current.pixels, current.image.mode, **get_query_args(params))
+        else:
+            # the rest only need the header, so the image is left undecoded
+            capacity = codec_obj.capacity(current.image, **get_query_args(params))
+    except (CodecError, ValueError) as e:
+        return {"error": str(e)}, 400
+    result: dict[str, Any] = {"capacity": capacity}
+    length = request.args.get("length", type=int)
+    if length is not None:
+        result["fits"] = capacity is None or length <= capacity
+        result["lsb_bits"] = lsb.recommend_bits(current.image, length)
+    return result
+
+
 @app.get("/current_image")
 def get_current_image():
-    if not current_image:
-        msg = "No image loaded"
-        raise ValueError(msg)
-    file = io.BytesIO()
-    current_image.save(file, format="PNG")
-    file.seek(0)
-    return send_file(file, mimetype="image/png")
+    """Serve the current image, only saving each version of it once for each set of output options.
+
+    An image which hasn't changed since it was uploaded is served as it was,
+    unless another format is asked for. Clients can revalidate their copy with
+    its ETag or modification time, to get a 304 response if it's unchanged.
+    """
+    current = require_image()
+    if current.source is not None and "format" not in request.args:
+        return send_rendition(current, current.version, None)
+    output = get_output_options()
+    etag = f"{current.version}-{output.format_}-{output.compress_level}-{int(output.optimize)}"
+    return send_rendition(current, etag, output)
+
+
+@app.get("/current_image/preview")
+def get_current_image_preview():
+    """Serve a downscaled, lossy copy of the current image to show in the page, made once per version and size.
+
+    The format is JPEG, or WebP for clients which accept it, unless one is
+    given. The bounds are given by ``width`` and ``height``.
+    """
+    current = require_image()
+    preview = get_preview_options()
+    etag = f"{current.version}-preview-{preview.format_}-{preview.max_width}x{preview.max_height}"
+    response = send_rendition(current, etag, preview)
+    if "format" not in request.args:
+        response.vary.add("Accept")
+    return response
 
 
 @app.post("/current_image")
 def post_current_image():
-    global current_image  # noqa: PLW0603 - global mutable
-    file = request.files["image"]
-    buffer = io.BytesIO()
-    file.save(buffer)
-    buffer.seek(0)
-    current_image = Image.open(buffer)
-    current_image.load()
+    """Store an uploaded image, without decoding it until a codec needs its pixels."""
+    try:
+        source = read_upload()
+        image = open_upload(io.BytesIO(source))
+        images.put(session_key(), StoredImage.from_image(image, source=source))
+    except ImageTooLargeError as e:
+        flash(f"Upload failed: {e}")
+        return str(e), 413
+    except UnidentifiedImageError as e:
+        flash(f"Upload failed: {e}")
+        return str(e), 415
     return "OK", 200
 
 
+def send_rendition(current: StoredImage, etag: str, options: OutputOptions | PreviewOptions | None) -> Response:
+    """Respond with an image saved with some options, or as it was uploaded if none are given."""
+    if not is_resource_modified(request.environ, etag=etag, last_modified=current.modified):
+        response = Response(status=304)
+    elif options is None:
+        response = Response(current.source, mimetype=current.source_mimetype)
+    else:
+        data = current.renditions.get(options)
+        if data is None:
+            file = io.BytesIO()
+            if isinstance(options, PreviewOptions):
+                save_preview(current.load(), file, options)
+            else:
+                save_image(current.load(), file, options)
+            data = file.getvalue()
+            images.add_rendition(session_key(), current, options, data)
+        response = Response(data, mimetype=options.format_info.mimetype)
+    response.set_etag(etag)
+    response.last_modified = current.modified
+    # the URL stays the same as the image changes, so it always has to be revalidated
+    response.cache_control.no_cache = True
+    return response
+
+
+def uses_file(codec: Codec, args: Mapping[str, Any], current: StoredImage) -> bool:
+    """Check whether a codec should be given the image file rather than its pixels.
+
+    Concat has to be in trailer mode, and notlsb hides the file itself, so is
+    given the uploaded file as it is, rather than it being saved again.
+    """
+    if codec is notlsb:
+        return current.source is not None
+    return codec is concat and args["trailer"]
+
+
+def current_file(current: StoredImage) -> bytes:
+    """Get the current image's file, as it was uploaded, or saved as a PNG if it has been changed since."""
+    if current.source is not None:
+        return current.source
+    file = io.BytesIO()
+    save_image(current.load(), file, OutputOptions())
+    return file.getvalue()
+
+
+def stored_file(data: bytes) -> StoredImage:
+    """Store an encoded image file as it is, so it's served with anything the codec appended to it."""
+    return StoredImage.from_image(open_upload(io.BytesIO(data)), source=data)
+
+
+def show_decoded(key: str, current: StoredImage, codec: Codec, message: bytes) -> None:
+    """Store a new version of the image with the message drawn on it, for codecs which show it there, as concat does.
+
+    Codecs are given the stored pixels to decode, which can't be drawn on, so
+    this is done separately, and only if the image hasn't been replaced since.
+    """
+    if codec is not concat:
+        return
+    image = current.load().copy()
+    concat.render_secret(image, message)
+    images.replace(key, current, StoredImage.from_image(image))
+
+
+def submit_job(
+    key: str,
+    description: str,
+    function: Callable[..., Any],
+    args: tuple[Any, ...],
+    on_done: Callable[[Any], None] | None = None,
+):
+    try:
+        job = jobs.submit(key, description, function, *args, on_done=on_done)
+    except QueueFullError as e:
+        return {"error": str(e)}, 429, {"Retry-After": "5"}
+    return job_info(job), 202, {"Location": f"/jobs/{job.job_id}"}
+
+
+def find_job(job_id: str) -> Job:
+    job = jobs.get(job_id, session_key())
+    if job is None:
+        abort(404)
+    return job
+
+
+def job_info(job: Job) -> dict[str, Any]:
+    info: dict[str, Any] = {
+        "id": job.job_id,
+        "description": job.description,
+        "status": job.status,
+        "elapsed": (job.finished or time.monotonic()) - job.submitted,
+    }
+    if job.status == "queued":
+        info["position"] = jobs.position(job)
+    if job.error is not None:
+        info["error"] = job.error
+    result = job.result
+    if job.status == "done" and isinstance(result, tuple):
+        # detecting the codec, which is described along with the message
+        info["codec"], result = result
+    if job.status == "done" and isinstance(result, bytes):
+        try:
+            info["message"] = result.decode("utf-8")
+        except UnicodeDecodeError as e:
+            info["status"] = "failed"
+            info["error"] = f"Decoding failed: {e}"
+    return info
+
+
+def session_key() -> str:
+    """Get the key of this session's image in the store, starting a session if needed."""
+    if "image_key" not in session:
+        session["image_key"] = secrets.token_urlsafe(16)
+    return session["image_key"]
+
+
+def current_image() -> StoredImage | None:
+    key = session.get("image_key")
+    return None if key is None else images.get(key)
+
+
+def require_image() -> StoredImage:
+    current = current_image()
+    if current is None:
+        msg = "No image loaded"
+        raise ValueError(msg)
+    return current
+
+
 def find_codec(short_name: str) -> Codec:
     for codec in CODECS:
         if codec.short_name == short_name:
             return codec
     msg = f"Codec {short_name} not found"
-    raise ValueError(msg)
+    raise CodecNotFoundError(msg)
 
 
-def get_args(params: list[CodecParam]) -> dict[str, Any]:
+def get_args(params: list[CodecParam], values: Mapping[str, str] | None = None) -> dict[str, Any]:
+    values = request.form if values is None else values
     args: dict[str, Any] = {}
     for param in params:
-        args[param.name] = param.type_(request.form.get(param.name, param.default))
+        args[param.name] = param.type_(values.get(param.name, param.default))
     return args
 
 
+def get_output_options() -> OutputOptions:
+    format_ = request.args.get("format", "png")
+    if format_ not in FORMATS:
+        msg = f"Unknown output format {format_}"
+        raise ValueError(msg)
+    compress_level = request.args.get("compress_level", DEFAULT_COMPRESS_LEVEL, type=int)
+    if not 0 <= compress_level <= 9:
+        msg = f"Compression level must be between 0 and 9, not {compress_level}"
+        raise ValueError(msg)
+    optimize = request.args.get("optimize", "false").lower() in ("1", "true", "yes")
+    return OutputOptions(format_=format_, compress_level=compress_level, optimize=optimize)
+
+
+def get_query_args(params: list[CodecParam]) -> dict[str, Any]:
+    """Get codec arguments from the query string, where flags are given as ``true`` or ``false``."""
+    args: dict[str, Any] = {}
+    for param in params:
+        value = request.args.get(param.name)
+        if value is None:
+            if param.required:
+                msg = f"The {param.name} parameter is required."
+                raise ValueError(msg)
+            args[param.name] = param.default
+        elif issubclass(param.type_, bool):
+            args[param.name] = parse_flag(value)
+        else:
+            args[param.name] = param.type_(value)
+    return args
+
+
+def parse_flag(value: str) -> bool:
+    """Parse a flag given in a query string."""
+    return value.lower() in ("1", "true", "yes")
+
+
+def read_upload() -> bytes:
+    """Read an uploaded image file, sent either as the request body or as the ``image`` part of a form.
+
+    Werkzeug refuses bodies bigger than ``MAX_CONTENT_LENGTH`` before they
+    are read. The file is read in one go, and the bytes kept rather than
+    copied again.
+    """
+    if request.mimetype == "multipart/form-data":
+        if "image" not in request.files:
+            msg = "The image part is required."
+            raise ValueError(msg)
+        stream = request.files["image"].stream
+    else:
+        stream = request.stream
+    with span("read"):
+        return stream.read()
+
+
+def open_upload(file: BinaryIO) -> Image.Image:
+    """Open an uploaded image, only reading its header.
+
+    :raises ImageTooLargeError: If the image has more than ``MAX_PIXELS`` pixels.
+    """
+    with span("open"):
+        try:
+            image = Image.open(file)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e)) from e
+    if image.width * image.height > MAX_PIXELS:
+        msg = (
+            f"Image has {image.width * image.height / 1e6:.1f} megapixels, more than the limit of {MAX_PIXELS / 1e6:g}."
+        )
+        raise ImageTooLargeError(msg)
+    return image
+
+
+def get_api_image() -> BinaryIO:
+    """Get the uploaded image file, having checked its header."""
+    source = io.BytesIO(read_upload())
+    open_upload(source)
+    source.seek(0)
+    return source
+
+
+def get_api_message() -> bytes:
+    if "message" in request.files:
+        return request.files["message"].read()
+    message = request.form.get("message", request.args.get("message"))
+    if message is None:
+        msg = "The message is required."
+        raise ValueError(msg)
+    return message.encode("utf-8")
+
+
+def open_image(file: BinaryIO) -> Image.Image:
+    image = open_upload(file)
+    with span("load"):
+        image.load()
+    return image
+
+
+def get_preview_options() -> PreviewOptions:
+    format_ = request.args.get("format")
+    if format_ is None:
+        format_ = "webp" if request.accept_mimetypes["image/webp"] else "jpeg"
+    if format_ not in PREVIEW_FORMATS:
+        msg = f"Unknown preview format {format_}"
+        raise ValueError(msg)
+    width = request.args.get("width", DEFAULT_PREVIEW_SIZE, type=int)
+    height = request.args.get("height", DEFAULT_PREVIEW_SIZE, type=int)
+    if not (0 < width <= MAX_PREVIEW_SIZE and 0 < height <= MAX_PREVIEW_SIZE):
+        msg = f"Preview bounds must be between 1 and {MAX_PREVIEW_SIZE} pixels"
+        raise ValueError(msg)
+    return PreviewOptions(format_=format_, max_width=width, max_height=height)
+
+
 def render(template: str, **kwargs: object):
     return render_template(
         template,
         codecs=CODECS,
-        current_image=bool(current_image),
+        current_image=current_image() is not None,
         issubclass=issubclass,
         bool=bool,
         int=int,
@@ -1,11 +1,81 @@
 window.onload = () => {
     document.getElementById("fileInput").onchange = (event) => {
-        let file = event.target.files[0];
-        let data = new FormData();
-        data.append("image", file);
+        // sent as the whole body, so the server can read it straight in
         fetch("/current_image", {
             method: "POST",
-            body: data,
+            body: event.target.files[0],
         }).then(() => window.location.reload());
     };
+
+    let form = document.querySelector(".toolbar__form");
+    if (form) {
+        form.onsubmit = (event) => {
+            event.preventDefault();
+            submitJob(form);
+        };
+    }
 };
+
+// Run an encode or decode as a background job, so a slow codec doesn't hold up the page
+function submitJob(form) {
+    let job = document.querySelector(".job");
+    let status = job.querySelector(".job__status");
+    let cancel = job.querySelector(".job__cancel");
+    let submit = form.querySelector("[type=submit]");
+
+    let finish = (text) => {
+        status.textContent = text;
+        cancel.hidden = true;
+        submit.disabled = false;
+    };
+
+    submit.disabled = true;
+    cancel.hidden = false;
+    job.hidden = false;
+    status.textContent = "Submitting...";
+
+    fetch("/jobs" + window.location.pathname, {
+        method: "POST",
+        body: new FormData(form),
+    }).then(async (response) => {
+        let info = await response.json();
+        if (!response.ok) {
+            finish(info.error);
+            return;
+        }
+        let url = response.headers.get("Location");
+        cancel.onclick = () => fetch(url, {method: "DELETE"});
+        let poll = async () => {
+            let info = await (await fetch(url)).json();
+            if (info.status === "queued") {
+                status.textContent = `Queued (${info.position} ahead)`;
+            } else if (info.status === "running") {
+                status.textContent = `Running for ${info.elapsed.toFixed(1)}s`;
+            } else if (info.status === "done") {
+                if (info.message === undefined) {
+                    window.location.reload();
+                    return;
+                }
+                document.querySelector(".decoded").value = info.message;
+                // some codecs also draw the message on the image
+                let preview = document.querySelector(".workspace__image");
+                if (preview) {
+                    preview.src = "/current_image/preview?t=" + Date.now();
+                }
+                if (info.codec !== undefined) {
+                    document.querySelector(".detected").textContent = `Found with ${info.codec}`;
+                }
+                finish(`Done in ${info.elapsed.toFixed(1)}s`);
+                return;
+            } else if (info.status === "cancelled") {
+                finish("Cancelled");
+                return;
+            } else {
+                finish(info.error);
+                return;
+            }
+            setTimeout(poll, 500);
+        };
+        poll();
+    }).catch(() => finish("Couldn't reach the server"));
+}
@@ -0,0 +1,198 @@
+"""A memory-bounded store of each session's current image.
+
+Alongside each image, its raw pixels are kept as a read-only array, so codecs
+which work on arrays can encode and decode it repeatedly without converting
+it again. Uploaded images are only decoded once a codec needs their pixels,
+though the memory they will need is counted from the start. Each version of
+an image also keeps the file it was uploaded as, if it hasn't been changed
+since, and the files it has been saved as, so they can be served again
+without re-encoding. Images are evicted least recently used first once the
+store is over its memory budget, and expire once they haven't been used for
+a while.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+
+import numpy as np
+from PIL import Image
+
+from pydis_jam23.codecs.common import array_to_image, image_to_array, raw_size
+from pydis_jam23.codecs.trace import span
+from pydis_jam23.output import OutputOptions, PreviewOptions
+
+
+class ImageTooLargeError(ValueError):
+    """An image which would never fit in the store's memory budget."""
+
+
+def now() -> datetime:
+    # HTTP dates only have whole seconds
+    return datetime.now(tz=UTC).replace(microsecond=0)
+
+
+@dataclass(frozen=True, eq=False)
+class StoredImage:
+    """An image, which may not have been decoded yet.
+
+    Only the image's header (its mode, size and format) should be used
+    directly. Anything needing its pixels should go through `load` or
+    `pixels`, which decode it once, even if called from many threads at once.
+    """
+
+    image: Image.Image
+    source: bytes | None = None
+    source_mimetype: str | None = None
+    version: str = field(default_factory=lambda: secrets.token_hex(8))
+    modified: datetime = field(default_factory=now)
+    # saved files, added through `ImageStore.add_rendition` so they are counted
+    renditions: dict[OutputOptions | PreviewOptions, bytes] = field(default_factory=dict)
+    _pixels: np.ndarray | None = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def from_image(cls, image: Image.Image, source: bytes | None = None) -> "StoredImage":
+        """Store an image, along with the file it was opened from, if it is to be served as it is.
+
+        The image is decoded when its pixels are first needed, so it can be
+        stored straight after being opened.
+        """
+        mimetype = Image.MIME.get(image.format) if source is not None and image.format else None
+        return cls(image=image, source=source if mimetype else None, source_mimetype=mimetype)
+
+    @classmethod
+    def from_pixels(cls, pixels: np.ndarray, like: "StoredImage") -> "StoredImage":
+        """Store an array given by a codec, from an image in the store."""
+        if pixels.shape == like.pixels.shape:
+            image = array_to_image(pixels, like.image.mode, like.image.size)
+        else:
+            # the codec made an image of its own, as noise does
+            image = Image.fromarray(pixels)
+        pixels.flags.writeable = False
+        return cls(image=image, _pixels=pixels)
+
+    def load(self) -> Image.Image:
+        """Get the image, decoding it if it hasn't been yet."""
+        return self._decode()[0]
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """The image's raw pixels, as a read-only array."""
+        return self._decode()[1]
+
+    @property
+    def size(self) -> int:
+        """The memory used by the image and its pixels, which are stored separately, and its files.
+
+        This is found from the image's header, so it is the same before and after it is decoded.
+        """
+        files = len(self.source or b"") + sum(len(data) for data in self.renditions.values())
+        return raw_size(self.image) * 2 + files
+
+    def _decode(self) -> tuple[Image.Image, np.ndarray]:
+        with self._lock:
+            if self._pixels is None:
+                with span("load"):
+                    self.image.load()
+                object.__setattr__(self, "_pixels", image_to_array(self.image, writable=False))
+            return self.image, self._pixels
+
+
+class ImageStore:
+    """Images keyed by session, safe to use from many threads at once.
+
+    Stored images are never modified, only replaced, so they can be used
+    after being got without holding any lock.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.size = 0
+        self._images: OrderedDict[str, tuple[StoredImage, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> StoredImage | None:
+        """Get a session's image, if it has one which hasn't expired or been evicted."""
+        with self._lock:
+            self._expire()
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images[key] = (entry[0], self.clock())
+            self._images.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, stored: StoredImage) -> None:
+        """Set a session's image, evicting others as needed to stay within budget.
+
+        :raises ImageTooLargeError: If the image is bigger than the whole budget.
+        """
+        self._check_size(stored)
+        with self._lock:
+            self._put(key, stored)
+
+    def replace(self, key: str, old: StoredImage, new: StoredImage) -> bool:
+        """Set a session's image, only if it is still ``old``, as `put` would.
+
+        :return: Whether the image was replaced.
+        """
+        self._check_size(new)
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None or entry[0] is not old:
+                return False
+            self._put(key, new)
+            return True
+
+    def add_rendition(
+        self, key: str, stored: StoredImage, options: OutputOptions | PreviewOptions, data: bytes
+    ) -> None:
+        """Keep an image as saved with some options, if it is still the session's current image."""
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is None or entry[0] is not stored or options in stored.renditions:
+                return
+            if stored.size + len(data) > self.max_bytes:
+                return
+            stored.renditions[options] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._images)))
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._images), "size": self.size, "max_bytes": self.max_bytes}
+
+    def _check_size(self, stored: StoredImage) -> None:
+        if stored.size > self.max_bytes:
+            msg = f"Image needs {stored.size // 2**20} MiB, but only {self.max_bytes // 2**20} MiB is available."
+            raise ImageTooLargeError(msg)
+
+    def _put(self, key: str, stored: StoredImage) -> None:
+        self._remove(key)
+        self._images[key] = (stored, self.clock())
+        self.size += stored.size
+        self._expire()
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._images)))
+
+    def _expire(self) -> None:
+        # entries are kept in order of use, so the expired ones are at the start
+        deadline = self.clock() - self.ttl
+        while self._images and next(iter(self._images.values()))[1] < deadline:
+            self._remove(next(iter(self._images)))
+
+    def _remove(self, key: str) -> None:
+        entry = self._images.pop(key, None)
+        if entry is not None:
+            self.size -= entry[0].size
@@ -0,0 +1,24 @@
+import pytest
+from pydis_jam23 import benchmark
+from pydis_jam23.codecs import edges
+
+
+@pytest.mark.parametrize("codec", ["lsb", "concat"])
+def test_benchmark_case(codec: str) -> None:
+    result = benchmark.run_case(benchmark.Case(codec, 0.01, "RGB", 100), repeat=2)
+    assert result.status == "ok"
+    assert result.extra["roundtrip"]
+    assert result.encode is not None
+    assert len(result.encode.seconds) == 2
+
+
+def test_benchmark_skips_oversized_payload() -> None:
+    result = benchmark.run_case(benchmark.Case("lsb", 0.01, "RGBA", 2**20), repeat=1)
+    assert result.status == "skipped"
+
+
+def test_benchmark_edges_cold() -> None:
+    edges.mask_cache.clear()
+    benchmark.run_case(benchmark.Case("edges", 0.01, "RGB", 100), repeat=3)
+    # every timed call computes its masks afresh
+    assert edges.mask_cache.hits == 0
@@ -0,0 +1,57 @@
+import io
+import pathlib
+
+import pytest
+from PIL import Image
+from pydis_jam23 import cli_app
+from pydis_jam23.codecs import concat, lsb
+from pydis_jam23.output import OutputOptions
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+
+
+def test_batch_roundtrip(wikimedia_image: Image.Image, tmp_path: pathlib.Path) -> None:
+    wikimedia_image.save(tmp_path / "cover.png")
+    (tmp_path / "message.txt").write_bytes(b"Hello, world!")
+    (tmp_path / "encode.txt").write_text("cover.png message.txt encoded.png\n")
+    (tmp_path / "decode.txt").write_text("encoded.png decoded.txt\nmissing.png missing.txt\n")
+    args = {"bits": 1, "msb": False}
+
+    items = cli_app.find_batch_items(tmp_path / "encode.txt", tmp_path, encoding=True)
+    assert cli_app.run_batch(items, lsb, args, jobs=1) == 0
+    items = cli_app.find_batch_items(tmp_path / "decode.txt", tmp_path, encoding=False)
+    assert cli_app.run_batch(items, lsb, args, jobs=1) == 1
+
+    assert (tmp_path / "decoded.txt").read_bytes() == b"Hello, world!"
+    assert not (tmp_path / "missing.txt").exists()
+
+
+def test_file_codec_output_format(wikimedia_image: Image.Image, tmp_path: pathlib.Path) -> None:
+    source = tmp_path / "image.png"
+    wikimedia_image.save(source)
+    target = io.BytesIO()
+    with source.open("rb") as plain:
+        cli_app.write_encoded(plain, target, b"hi", concat, {"trailer": False}, OutputOptions(format_="bmp"))
+    target.seek(0)
+    with Image.open(target) as encoded:
+        assert encoded.format == "BMP"
+
+
+def test_jobs_default_without_cpu_count(monkeypatch: pytest.MonkeyPatch) -> None:
+    # os.cpu_count can't always tell, in which case one worker is used
+    monkeypatch.setattr(cli_app.os, "cpu_count", lambda: None)
+    assert cli_app.build_arg_parser().parse_args(["-c", "-"]).jobs == 1
+
+
+def test_batch_unexpected_error(
+    wikimedia_image: Image.Image, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture
+) -> None:
+    wikimedia_image.save(tmp_path / "cover.png")
+    (tmp_path / "decode.txt").write_text("cover.png decoded.txt\n")
+    items = cli_app.find_batch_items(tmp_path / "decode.txt", tmp_path, encoding=False)
+    # missing codec arguments make the codec raise a KeyError in the worker
+    assert cli_app.run_batch(items, lsb, {}, jobs=1) == 1
+    errors = capsys.readouterr().err
+    assert "cover.png: KeyError: 'bits'" in errors
+    assert "Processed 1 images (0 succeeded, 1 failed)" in errors
+    assert not (tmp_path / "decoded.txt").exists()
@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image
+from pydis_jam23.codecs import CodecError, concat
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"",
+        b"Hello, world!",
+        bytes(range(256)),
+    ],
+)
+@pytest.mark.parametrize("shift_level", [concat.BitShift._min, concat.BitShift.med, concat.BitShift._max])
+def test_message_roundtrip(wikimedia_image: Image.Image, message: bytes, shift_level: int) -> None:
+    encoded = concat.encode(wikimedia_image.copy(), message, shift_level=shift_level)
+    assert concat.decode(encoded, shift_level=shift_level) == message
+
+
+def test_legacy_message(wikimedia_image: Image.Image) -> None:
+    image = wikimedia_image.copy()
+    image.putdata(concat.DataSect.start + b"a38e6060" + concat.DataSect.end)
+    assert concat.decode(image) == b"az  "
+
+
+def test_no_message(wikimedia_image: Image.Image) -> None:
+    with pytest.raises(CodecError):
+        concat.decode(wikimedia_image.copy())
+
+
+def test_trailer_roundtrip(wikimedia_image: Image.Image) -> None:
+    source = io.BytesIO()
+    wikimedia_image.save(source, format="PNG")
+    source.seek(0)
+    target = io.BytesIO()
+    concat.encode_file(source, target, bytes(range(256)), trailer=True)
+    assert target.getvalue().startswith(source.getvalue())
+    target.seek(0)
+    assert Image.open(target).tobytes() == wikimedia_image.tobytes()
+    assert concat.decode_file(target, trailer=True) == bytes(range(256))
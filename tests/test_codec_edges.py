@@ -22,3 +22,27 @@ def test_message_roundtrip(wikimedia_image: Image.Image, message: bytes, mask_co
 def test_message_too_long(wikimedia_image: Image.Image) -> None:
     with pytest.raises(CodecError):
         edges.encode(wikimedia_image, bytes(1_000_000))
+
+
+def test_mask_cache_hits(wikimedia_image: Image.Image) -> None:
+    cache = edges.MaskCache(max_bytes=2**30)
+    channel = wikimedia_image.getchannel(0)
+    first = cache.get_edges(channel)
+    assert cache.get_edges(channel) == first == edges.get_edges(channel).tobytes()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_mask_cache_bounded(wikimedia_image: Image.Image) -> None:
+    mask_size = wikimedia_image.width * wikimedia_image.height
+    cache = edges.MaskCache(max_bytes=mask_size)
+    for channel in wikimedia_image.split():
+        cache.get_edges(channel)
+    assert cache.stats()["entries"] == 1
+    assert cache.size <= mask_size
+
+
+def test_capacity_is_exact(wikimedia_image: Image.Image) -> None:
+    capacity = edges.capacity(wikimedia_image)
+    assert edges.decode(edges.encode(wikimedia_image, bytes(capacity))) == bytes(capacity)
+    with pytest.raises(CodecError):
+        edges.encode(wikimedia_image, bytes(capacity + 1))
@@ -1,6 +1,10 @@
+import hashlib
+import random
+
 import pytest
 from PIL import Image
 from pydis_jam23.codecs import CodecError, lsb
+from pydis_jam23.codecs.common import image_to_array
 
 from .common import wikimedia_image  # noqa: F401 - import for fixtures
 
@@ -23,3 +27,111 @@ def test_message_roundtrip(wikimedia_image: Image.Image, message: bytes, bits: i
 def test_message_too_long(wikimedia_image: Image.Image) -> None:
     with pytest.raises(CodecError):
         lsb.encode(wikimedia_image, bytes(1_000_000), bits=1, msb=False)
+
+
+def test_encode_array_in_place(wikimedia_image: Image.Image) -> None:
+    pixels = image_to_array(wikimedia_image)
+    encoded = lsb.encode_array(pixels, wikimedia_image.mode, b"Hello, world!", in_place=True, bits=2, msb=False)
+    assert encoded is pixels
+    assert lsb.decode_array(pixels, wikimedia_image.mode, bits=2, msb=False) == b"Hello, world!"
+
+
+def test_encode_array_copy(wikimedia_image: Image.Image) -> None:
+    pixels = image_to_array(wikimedia_image, writable=False)
+    encoded = lsb.encode_array(pixels, wikimedia_image.mode, b"Hello, world!", bits=1, msb=False)
+    assert encoded is not pixels
+    assert pixels.tobytes() == wikimedia_image.tobytes()
+    assert lsb.decode_array(encoded, wikimedia_image.mode, bits=1, msb=False) == b"Hello, world!"
+
+
+@pytest.mark.parametrize("length_known", [False, True])
+def test_stream_roundtrip(wikimedia_image: Image.Image, length_known: bool) -> None:
+    message = bytes(range(256)) * 10
+    chunks = [message[start : start + 1000] for start in range(0, len(message), 1000)]
+    length = len(message) if length_known else None
+    encoded = lsb.encode_stream(wikimedia_image, chunks, length, bits=2, msb=False)
+    assert lsb.decode(encoded, bits=2, msb=False) == message
+    assert list(lsb.decode_stream(encoded, chunk_size=1000, bits=2, msb=False)) == chunks
+    if length_known:
+        assert encoded.tobytes() == lsb.encode(wikimedia_image, message, bits=2, msb=False).tobytes()
+
+
+@pytest.mark.parametrize("bits", [1, 3])
+def test_capacity_is_exact(wikimedia_image: Image.Image, bits: int) -> None:
+    capacity = lsb.capacity(wikimedia_image, bits=bits, msb=False)
+    encoded = lsb.encode(wikimedia_image, bytes(capacity), bits=bits, msb=False)
+    assert lsb.decode(encoded, bits=bits, msb=False) == bytes(capacity)
+    with pytest.raises(CodecError):
+        lsb.encode(wikimedia_image, bytes(capacity + 1), bits=bits, msb=False)
+
+
+def test_recommend_bits(wikimedia_image: Image.Image) -> None:
+    one_bit = lsb.capacity(wikimedia_image, bits=1, msb=False)
+    assert lsb.recommend_bits(wikimedia_image, one_bit) == 1
+    assert lsb.recommend_bits(wikimedia_image, one_bit + 1) == 2
+    assert lsb.recommend_bits(wikimedia_image, one_bit * 9) is None
+
+
+@pytest.mark.parametrize(("bits", "msb"), [(1, False), (3, True), (7, False)])
+def test_bytes_in_blocks(monkeypatch: pytest.MonkeyPatch, bits: int, msb: bool) -> None:
+    monkeypatch.setattr(lsb, "BLOCK_SIZE", 5)
+    data = bytearray(random.Random(bits).randbytes(400))
+    original = bytes(data)
+    message = b"spread across several blocks"
+    lsb.write_bytes_to_image(data, 13, message, bits, msb)
+    assert lsb.read_bytes_from_image(data, 13, len(message), bits, msb) == message
+    # the bits which don't hold data are left alone, including those in the pixels either side
+    mask = sum(1 << position for position in lsb.bit_positions(bits, msb))
+    assert all(new & ~mask == old & ~mask for new, old in zip(data, original, strict=True))
+    assert data[:1] == original[:1]
+
+
+def test_decode_reads_prefix_rows(monkeypatch: pytest.MonkeyPatch) -> None:
+    # a tall image, where the message only takes up the first few rows
+    image = lsb.encode(Image.new("RGB", (100, 10_000)), b"Hello, world!", bits=1, msb=False)
+    rows = []
+    crop = Image.Image.crop
+
+    def spy(image: Image.Image, box: tuple[int, int, int, int]) -> Image.Image:
+        rows.append((box[1], box[3]))
+        return crop(image, box)
+
+    monkeypatch.setattr(Image.Image, "crop", spy)
+    assert lsb.decode(image, bits=1, msb=False) == b"Hello, world!"
+    assert list(lsb.decode_stream(image, bits=1, msb=False)) == [b"Hello, world!"]
+    # the header and message take 112 bits, which at one bit per byte fit in the first row
+    assert rows
+    assert all(end <= 1 for _, end in rows)
+
+
+# SHA-256 digests of a fixed cover encoded by the original bit-at-a-time implementation, which the
+# bit plane engine has to match exactly
+GOLDEN_COVER = Image.frombytes("RGB", (12, 10), bytes((i * 37 + 11) % 256 for i in range(12 * 10 * 3)))
+
+
+@pytest.mark.parametrize(
+    ("bits", "msb", "digest"),
+    [
+        (1, False, "021dd735d27c1552691e497d5e6d2a12c1f50b0fbb2c15648baa7c3a1dec1e6a"),
+        (1, True, "fa43a1916ae89ba5079513719f5abdfe66295f475e7fb3e066a95abf5d462c18"),
+        (2, False, "630a53981b74300624a969c606bb4883da9f2ce2f3f7200fc1fbc877d26f2c6f"),
+        (2, True, "3e436b5904252e75ddf067030d478aebcbc06c9c532c6dd7e8a8e7c03212fad4"),
+        (3, False, "36a1588dc1a4390e82e6a4aa95af6f344f39afb67d51e993fdeda5d84fdfc716"),
+        (3, True, "bb500ac7c5457c04f6b83478dc5a5d889c821346c2019b91d128330210ba2834"),
+        (4, False, "203d08412052e958b661480ebaad7954a11f8cf12ca303993a0dd8c43a68cf78"),
+        (4, True, "e4cca61dc81bab8413576901a0a2b4ddca4bd949126a8436cc63b3b93407673e"),
+        (5, False, "d51cfd9d71d08990e24fb8cbbda833b3f2f5b50599b281491cb93475eacf461d"),
+        (5, True, "54b2546b15e244a2c8a535925d2d5757dcfd8b22895f572fc9a67e1346b4d5ba"),
+        (6, False, "7f945813e1f698dd76a1a8a0aef3317f2a8505e9f7a82623d0ed6294c6a29cca"),
+        (6, True, "5b81cf34427e707f9db04d7a4df7408671c644a32bc77e5b5a61b4ee6104a087"),
+        (7, False, "5950cbcb2a5e4fc0083ec05d3f5561a83cfd7d4e85b542af652f461a19966fa9"),
+        (7, True, "f10e892902845916dab6c55033e891443b76717f92c91727fe4d46a35d601aa4"),
+        (8, False, "7c33cb060ff94f0f3a47690243d7078f4facfc9287da36a6a7a15d943d273c34"),
+        (8, True, "3d5233aa4c3afcf230552c9befb0f03ba1c0d6f0560976c3f27fd517308f8b2a"),
+    ],
+)
+def test_golden_encoding(bits: int, msb: bool, digest: str) -> None:
+    encoded = lsb.encode(GOLDEN_COVER.copy(), b"Hello, world!", bits=bits, msb=msb)
+    assert hashlib.sha256(encoded.tobytes()).hexdigest() == digest
+    encoded = lsb.encode_stream(GOLDEN_COVER.copy(), [b"Hello, ", b"world!"], 13, bits=bits, msb=msb)
+    assert hashlib.sha256(encoded.tobytes()).hexdigest() == digest
@@ -0,0 +1,24 @@
+import pytest
+from pydis_jam23.codecs import noise
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"",
+        b"Hello, world!",
+        bytes(range(256)) * 100,
+    ],
+)
+@pytest.mark.parametrize("bits", [1, 3, 8])
+@pytest.mark.parametrize("msb", [False, True])
+def test_message_roundtrip(message: bytes, bits: int, msb: bool) -> None:
+    encoded = noise.encode(None, message, bits=bits, msb=msb, min_pixels=0)
+    assert noise.decode(encoded, bits=bits, msb=msb) == message
+
+
+def test_size_to_fit() -> None:
+    encoded = noise.encode(None, b"Hello, world!", bits=1, msb=False, min_pixels=0)
+    assert encoded.width * encoded.height * 3 < 200
+    encoded = noise.encode(None, b"Hello, world!", bits=1, msb=False, min_pixels=1024 * 768)
+    assert encoded.width * encoded.height >= 1024 * 768
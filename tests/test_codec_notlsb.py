@@ -0,0 +1,38 @@
+import io
+
+import pytest
+from PIL import Image
+from pydis_jam23.codecs import lsb, notlsb
+
+from .common import RES_DIR
+
+
+def test_font_cached() -> None:
+    notlsb.load_font.cache_clear()
+    notlsb.char_width.cache_clear()
+    image = Image.new("RGB", (8, 8))
+    notlsb.encode(image, b"hello", bits=1, msb=False)
+    notlsb.encode(image, b"hello", bits=1, msb=False)
+    # the second render reuses the font and the widths of its four different letters
+    assert notlsb.load_font.cache_info().misses == 1
+    assert notlsb.load_font.cache_info().hits >= 1
+    assert notlsb.char_width.cache_info().misses == 4
+    assert notlsb.char_width.cache_info().hits >= 4
+
+
+def test_encode_file_keeps_source(monkeypatch: pytest.MonkeyPatch) -> None:
+    source = (RES_DIR / "vista_de_cusco.webp").read_bytes()
+    saved = []
+    save = Image.Image.save
+
+    def spy(image: Image.Image, *args, **kwargs) -> None:
+        saved.append(image.size)
+        save(image, *args, **kwargs)
+
+    monkeypatch.setattr(Image.Image, "save", spy)
+    target = io.BytesIO()
+    notlsb.encode_file(io.BytesIO(source), target, b"hello", bits=8, msb=False)
+    # only the render is saved, with the original file hidden in it byte for byte
+    assert len(saved) == 1
+    target.seek(0)
+    assert lsb.decode(Image.open(target), bits=8, msb=False) == source
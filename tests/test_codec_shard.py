@@ -0,0 +1,61 @@
+import io
+import pathlib
+import random
+import sys
+
+import pytest
+from PIL import Image
+from pydis_jam23 import cli_app
+from pydis_jam23.codecs import CodecError, lsb, shard
+from pydis_jam23.output import OutputOptions
+
+ARGS = {"bits": 2, "msb": False}
+
+
+def covers(*widths: int) -> list[Image.Image]:
+    return [Image.new("RGB", (width, 32), (index * 40, 100, 200)) for index, width in enumerate(widths)]
+
+
+def test_shard_roundtrip_any_order() -> None:
+    images = covers(64, 128, 32)
+    message = random.Random(0).randbytes(shard.capacity(images, **ARGS))
+    encoded = shard.encode(images, message, **ARGS)
+    assert shard.decode(encoded[::-1], **ARGS) == message
+    assert shard.decode([encoded[1], *encoded], **ARGS) == message
+
+
+def test_shards_sized_by_capacity() -> None:
+    capacities = [lsb.capacity(image, **ARGS) for image in covers(64, 128)]
+    shards = shard.split(bytes(300), capacities)
+    assert [len(data) - shard.HEADER.size for data in shards] == [100, 200]
+
+
+def test_shard_errors() -> None:
+    images = covers(64, 64, 64)
+    encoded = shard.encode(images, b"Hello, world!", **ARGS)
+    other = shard.encode(images, b"Hello, world!", **ARGS)
+    with pytest.raises(CodecError, match="Missing shard 2"):
+        shard.decode([encoded[0], encoded[2]], **ARGS)
+    with pytest.raises(CodecError, match="different message"):
+        shard.decode([encoded[0], other[1], encoded[2]], **ARGS)
+    with pytest.raises(CodecError, match="does not contain a shard"):
+        shard.decode([images[0], *encoded], **ARGS)
+    damaged = bytearray(lsb.decode(encoded[1], **ARGS))
+    damaged[-1] ^= 1
+    with pytest.raises(CodecError, match="damaged"):
+        shard.join([lsb.decode(encoded[0], **ARGS), bytes(damaged)])
+    with pytest.raises(CodecError, match="too long"):
+        shard.encode(images, bytes(shard.capacity(images, **ARGS) + 1), **ARGS)
+
+
+def test_shard_cli(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    paths = []
+    for index, image in enumerate(covers(64, 96)):
+        paths.append(tmp_path / f"cover{index}.png")
+        image.save(paths[-1])
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(b"Hello, world!")))
+    assert cli_app.encode_shards(paths, tmp_path / "out", lsb, ARGS, jobs=1, output=OutputOptions()) == 0
+    stdout = io.TextIOWrapper(io.BytesIO())
+    monkeypatch.setattr(sys, "stdout", stdout)
+    cli_app.decode_shards(sorted((tmp_path / "out").iterdir(), reverse=True), lsb, ARGS, jobs=1)
+    assert stdout.buffer.getvalue() == b"Hello, world!"
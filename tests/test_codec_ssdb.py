@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from PIL import Image
+from pydis_jam23.codecs import CodecError, ssdb
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"",
+        b"Hello, world!",
+        bytes(range(256)),
+    ],
+)
+@pytest.mark.parametrize("legacy", [False, True])
+def test_message_roundtrip(wikimedia_image: Image.Image, message: bytes, legacy: bool) -> None:
+    encoded = ssdb.encode(wikimedia_image, message, password="hunter2", legacy=legacy)
+    assert ssdb.decode(encoded, password="hunter2", legacy=legacy) == message
+
+
+def test_message_too_long(wikimedia_image: Image.Image) -> None:
+    with pytest.raises(CodecError):
+        ssdb.encode(wikimedia_image, bytes(1_000_000), password="hunter2", legacy=False)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 100, 4096, 5000])
+def test_permutation_is_bijective(size: int) -> None:
+    permutation = ssdb.KeyedPermutation(size, "hunter2")
+    positions = permutation[np.arange(size)]
+    assert sorted(positions.tolist()) == list(range(size))
+
+
+def test_permutation_is_index_addressable() -> None:
+    permutation = ssdb.KeyedPermutation(10_000, "hunter2")
+    positions = permutation[np.arange(10_000)]
+    assert permutation[np.array([1234])][0] == positions[1234]
@@ -0,0 +1,134 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+from pydis_jam23.codecs import concat, detect, edges, lsb, noise, notlsb, ssdb
+from pydis_jam23.codecs.common import ImageRows, encode_varint, image_to_array, raw_size, text_confidence
+from pydis_jam23.jobs import detect_job
+from pydis_jam23.web import app
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+
+MESSAGE = b"The quick brown fox jumps over the lazy dog."
+
+
+@pytest.mark.parametrize(("bits", "msb"), [(1, False), (3, True), (8, False)])
+def test_probe_lsb(wikimedia_image: Image.Image, bits: int, msb: bool) -> None:
+    encoded = lsb.encode(wikimedia_image, MESSAGE, bits=bits, msb=msb)
+    probe = lsb.probe(encoded)
+    assert probe.args == {"bits": bits, "msb": msb}
+    assert probe.confidence > detect.LIKELY_CONFIDENCE
+
+
+def test_probe_messages_match_reads(wikimedia_image: Image.Image) -> None:
+    encoded = lsb.encode(wikimedia_image, MESSAGE, bits=3, msb=True)
+    raw = encoded.tobytes()
+    found = []
+    for args, length, sample in lsb.probe_messages(encoded, lsb.PROBE_SAMPLE_SIZE):
+
+        def read_bytes(offset: int, length: int, args: dict = args) -> bytes:
+            return lsb.read_bytes_from_image(raw, offset, length, args["bits"], args["msb"])
+
+        assert lsb.read_length(read_bytes) == (length, len(encode_varint(length)) * 8)
+        assert read_bytes(len(encode_varint(length)) * 8, len(sample)) == sample
+        found.append((args, length, sample))
+    assert ({"bits": 3, "msb": True}, len(MESSAGE), MESSAGE[: lsb.PROBE_SAMPLE_SIZE]) in found
+
+
+def test_probe_reads_prefix_once(wikimedia_image: Image.Image, monkeypatch: pytest.MonkeyPatch) -> None:
+    encoded = lsb.encode(wikimedia_image, MESSAGE, bits=3, msb=True)
+    reads = []
+    read = ImageRows.read
+
+    def spy(rows: ImageRows, start: int, end: int) -> tuple[bytes, int]:
+        reads.append((start, end))
+        return read(rows, start, end)
+
+    monkeypatch.setattr(ImageRows, "read", spy)
+    # the bits are unpacked from the prefix, not read a byte at a time
+    monkeypatch.setattr(lsb, "read_bytes_from_image", None)
+    assert lsb.probe(encoded).args == {"bits": 3, "msb": True}
+    assert reads == [(0, (len(encode_varint(raw_size(encoded))) + lsb.PROBE_SAMPLE_SIZE) * 8)]
+
+
+@pytest.mark.parametrize("text", [b"hi", b"Hello", "привет".encode(), MESSAGE])
+def test_text_confidence(text: bytes) -> None:
+    assert text_confidence(text) > detect.LIKELY_CONFIDENCE
+
+
+@pytest.mark.parametrize("sample", [b"", b"a", b"\x00\x01\x02\x03", b"Ws5Ws5Ws5Ws5Ws5", b"m\xdbm\xdbmmm\xdbmm\xdb"])
+def test_text_confidence_unlikely(sample: bytes) -> None:
+    assert text_confidence(sample) <= detect.LIKELY_CONFIDENCE
+
+
+def test_probe_unlikely(wikimedia_image: Image.Image) -> None:
+    wikimedia_image.load()
+    assert lsb.probe(wikimedia_image).confidence < detect.LIKELY_CONFIDENCE
+    assert concat.probe(wikimedia_image).confidence == 0
+    assert notlsb.probe(wikimedia_image).confidence == 0
+    # the cover is a photo, so doesn't look like noise
+    assert noise.probe(wikimedia_image).confidence < detect.LIKELY_CONFIDENCE
+    assert ssdb.probe(ssdb.encode(wikimedia_image, MESSAGE, password="secret")).confidence == 0
+
+
+def test_probe_markers(wikimedia_image: Image.Image) -> None:
+    assert concat.probe(concat.encode(wikimedia_image, MESSAGE)).confidence == 1
+    hidden = notlsb.encode(wikimedia_image.copy(), b"hi", bits=8, msb=False)
+    assert notlsb.probe(hidden).confidence > detect.LIKELY_CONFIDENCE
+
+
+@pytest.mark.parametrize(
+    ("codec", "args"),
+    [(lsb, {"bits": 2, "msb": True}), (concat, {}), (noise, {"bits": 1, "msb": False, "min_pixels": 0})],
+)
+def test_detect_decode(wikimedia_image: Image.Image, codec, args: dict) -> None:
+    encoded = codec.encode(wikimedia_image, MESSAGE, **args)
+    candidate, message = detect.decode(encoded, workers=2)
+    assert message == MESSAGE
+    # noise hides its message just as LSB does, so either decodes it
+    assert candidate.codec in ({codec, lsb} if codec is noise else {codec})
+    ranking = detect.rank(encoded)
+    assert ranking[0].codec == candidate.codec
+    assert [c.probe.confidence for c in ranking] == sorted((c.probe.confidence for c in ranking), reverse=True)
+
+
+def test_detect_short_message(wikimedia_image: Image.Image) -> None:
+    # the edges probe only finds a marker, so its message has to look like text
+    candidate, message = detect.decode(edges.encode(wikimedia_image, b"hi", test_channel=0))
+    assert (candidate.codec, message) == (edges, b"hi")
+    assert candidate.probe.confidence > detect.LIKELY_CONFIDENCE
+
+
+def test_detect_no_message() -> None:
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (200, 300, 3), dtype=np.uint8))
+    with pytest.raises(detect.NoMessageError, match="best guess"):
+        detect.decode(image)
+    candidate, _ = detect.decode(image, force=True)
+    assert candidate.probe.confidence <= detect.LIKELY_CONFIDENCE
+    file = io.BytesIO()
+    image.save(file, format="PNG")
+    client = app.test_client()
+    assert client.post("/api/v1/detect", data=file.getvalue()).status_code == 422
+    assert client.post("/api/v1/detect?force=true", data=file.getvalue()).status_code == 200
+
+
+def test_describe(wikimedia_image: Image.Image) -> None:
+    encoded = lsb.encode(wikimedia_image, MESSAGE, bits=3, msb=True)
+    description, message = detect_job(image_to_array(encoded), encoded.mode, encoded.size, False)
+    assert message == MESSAGE
+    assert description.startswith("LSB (Bits 3, MSB, ")
+
+
+def test_web_detect(wikimedia_image: Image.Image) -> None:
+    encoded = io.BytesIO()
+    lsb.encode(wikimedia_image, MESSAGE, bits=2, msb=False).save(encoded, format="PNG")
+    client = app.test_client()
+    client.post("/current_image", data=encoded.getvalue())
+    page = client.post("/detect")
+    assert MESSAGE.decode() in page.text
+    assert "Found with LSB" in page.text
+    response = client.post("/api/v1/detect", data=encoded.getvalue())
+    assert response.data == MESSAGE
+    assert response.headers["X-Stego-Codec"].startswith("LSB (Bits 2, ")
+    assert client.post("/api/v1/detect", data=b"not an image").status_code == 415
@@ -0,0 +1,50 @@
+import pytest
+from PIL import Image
+from pydis_jam23.output import OutputOptions
+from pydis_jam23.web.store import ImageStore, ImageTooLargeError, StoredImage
+
+
+def stored(size: int) -> StoredImage:
+    return StoredImage.from_image(Image.new("L", (size, 1)))
+
+
+def test_store_evicts_least_recently_used() -> None:
+    store = ImageStore(max_bytes=2 * 180, ttl=60)
+    store.put("a", stored(100))
+    store.put("b", stored(50))
+    assert store.get("a") is not None
+    store.put("c", stored(50))
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.size == 2 * 150
+
+
+def test_store_expires_unused() -> None:
+    now = 0.0
+    store = ImageStore(max_bytes=2**20, ttl=10, clock=lambda: now)
+    store.put("a", stored(10))
+    store.put("b", stored(10))
+    now = 8
+    assert store.get("a") is not None
+    now = 12
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.stats()["entries"] == 1
+
+
+def test_store_rejects_oversized() -> None:
+    store = ImageStore(max_bytes=100, ttl=60)
+    with pytest.raises(ImageTooLargeError):
+        store.put("a", stored(100))
+
+
+def test_store_counts_renditions() -> None:
+    store = ImageStore(max_bytes=2**20, ttl=60)
+    image = stored(100)
+    store.put("a", image)
+    store.add_rendition("a", image, OutputOptions(), b"x" * 50)
+    store.add_rendition("a", stored(100), OutputOptions(format_="bmp"), b"x" * 50)
+    assert list(image.renditions) == [OutputOptions()]
+    assert store.size == 2 * 100 + 50
+    store.discard("a")
+    assert store.size == 0
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from PIL import Image
+from pydis_jam23.codecs.common import image_to_array
+from pydis_jam23.jobs import Job, JobQueue, QueueFullError, decode_job, encode_job
+from pydis_jam23.web import app, jobs
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+from .test_web import upload
+
+
+def wait(job: Job) -> Job:
+    while job.finished is None:
+        time.sleep(0.05)
+    return job
+
+
+def test_job_roundtrip() -> None:
+    queue = JobQueue(max_workers=1, max_pending=2)
+    try:
+        job = queue.submit("owner", "echo", str.upper, "hello")
+        assert wait(job).status == "done"
+        assert job.result == "HELLO"
+        assert queue.get(job.job_id, "owner") is job
+        assert queue.get(job.job_id, "someone else") is None
+    finally:
+        queue.shutdown()
+
+
+def test_job_errors_reported() -> None:
+    queue = JobQueue(max_workers=1, max_pending=2)
+    try:
+        job = queue.submit("owner", "bad", int, "not a number")
+        assert wait(job).status == "failed"
+        assert "invalid literal" in job.error
+    finally:
+        queue.shutdown()
+
+
+def test_queue_full() -> None:
+    queue = JobQueue(max_workers=1, max_pending=1)
+    try:
+        job = queue.submit("owner", "sleep", time.sleep, 0.5)
+        with pytest.raises(QueueFullError):
+            queue.submit("owner", "sleep", time.sleep, 0.5)
+        queue.cancel(job)
+        assert job.status == "cancelled"
+        wait(job)
+        # the result is thrown away, but the worker is free again
+        assert job.result is None
+        queue.submit("owner", "sleep", time.sleep, 0)
+    finally:
+        queue.shutdown()
+
+
+def test_codec_jobs(wikimedia_image: Image.Image) -> None:
+    image = wikimedia_image.convert("RGB")
+    pixels = encode_job(
+        "lsb", image_to_array(image), image.mode, image.size, b"Hello, world!", {"bits": 1, "msb": False}
+    )
+    assert decode_job("lsb", pixels, image.mode, image.size, {"bits": 1, "msb": False}) == b"Hello, world!"
+
+
+def test_web_jobs(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(wikimedia_image)
+    try:
+        for path, data in [
+            ("/jobs/encode/lsb", {"message": "Hello, world!", "bits": "1"}),
+            ("/jobs/decode/lsb", {"bits": "1"}),
+            ("/jobs/detect", {}),
+        ]:
+            response = client.post(path, data=data)
+            assert response.status_code == 202
+            while (info := client.get(response.headers["Location"]).json)["status"] in ("queued", "running"):
+                time.sleep(0.05)
+            assert info["status"] == "done"
+        assert info["message"] == "Hello, world!"
+        assert info["codec"].startswith("LSB (Bits 1, ")
+        assert app.test_client().get(response.headers["Location"]).status_code == 404
+    finally:
+        jobs.shutdown()
+
+
+def test_web_file_jobs(wikimedia_image: Image.Image) -> None:
+    client, uploaded = upload(wikimedia_image)
+    try:
+        for path, data in [
+            ("/jobs/encode/concat", {"message": "Hello, world!", "trailer": "on"}),
+            ("/jobs/decode/concat", {"trailer": "on"}),
+        ]:
+            response = client.post(path, data=data)
+            assert response.status_code == 202
+            while (info := client.get(response.headers["Location"]).json)["status"] in ("queued", "running"):
+                time.sleep(0.05)
+            assert info["status"] == "done"
+            if path.startswith("/jobs/encode"):
+                assert "message" not in info
+                assert client.get("/current_image").data.startswith(uploaded)
+        assert info["message"] == "Hello, world!"
+    finally:
+        jobs.shutdown()
@@ -0,0 +1,40 @@
+import io
+
+import pytest
+from PIL import Image
+from pydis_jam23.codecs import CodecError
+from pydis_jam23.output import FORMATS, OutputOptions, PreviewOptions, save_image, save_preview
+
+
+@pytest.mark.parametrize("format_", FORMATS)
+def test_output_roundtrip(format_: str):
+    image = Image.frombytes("RGB", (16, 8), bytes(range(256)) * 3)
+    file = io.BytesIO()
+    assert save_image(image, file, OutputOptions(format_=format_, compress_level=0)) >= 0
+    file.seek(0)
+    assert Image.open(file).tobytes() == image.tobytes()
+
+
+def test_output_unsupported_mode():
+    with pytest.raises(CodecError):
+        save_image(Image.new("LA", (4, 4)), io.BytesIO(), OutputOptions(format_="bmp"))
+
+
+@pytest.mark.parametrize(
+    ("mode", "format_", "expected_mode"),
+    [("RGB", "jpeg", "RGB"), ("RGBA", "webp", "RGBA"), ("RGBA", "jpeg", "RGB"), ("I;16", "jpeg", "RGB")],
+)
+def test_preview_fits_bounds(mode: str, format_: str, expected_mode: str):
+    file = io.BytesIO()
+    save_preview(Image.new(mode, (400, 100)), file, PreviewOptions(format_=format_, max_width=100, max_height=100))
+    file.seek(0)
+    preview = Image.open(file)
+    assert preview.size == (100, 25)
+    assert preview.mode == expected_mode
+
+
+def test_preview_not_scaled_up():
+    file = io.BytesIO()
+    save_preview(Image.new("RGB", (40, 10)), file, PreviewOptions())
+    file.seek(0)
+    assert Image.open(file).size == (40, 10)
@@ -0,0 +1,23 @@
+from PIL import Image
+from pydis_jam23.codecs import lsb
+from pydis_jam23.codecs.trace import span, tracing
+
+from .common import wikimedia_image  # noqa: F401 - import for fixtures
+
+
+def test_spans_recorded(wikimedia_image: Image.Image) -> None:
+    with tracing() as timings:
+        encoded = lsb.encode(wikimedia_image, b"Hello, world!", bits=1, msb=False)
+        lsb.decode(encoded, bits=1, msb=False)
+    stages = timings.as_dict()
+    assert list(stages)[:3] == ["tobytes", "embed", "frombytes"]
+    assert stages["extract"]["calls"] > 1
+    assert "embed;dur=" in timings.server_timing()
+
+
+def test_spans_ignored_when_not_tracing() -> None:
+    with tracing() as timings:
+        pass
+    with span("stage"):
+        pass
+    assert timings.as_dict() == {}
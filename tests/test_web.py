@@ -0,0 +1,166 @@
+import io
+
+import pytest
+from flask.testing import FlaskClient
+from PIL import Image
+from pydis_jam23 import web
+from pydis_jam23.codecs import concat, edges, lsb, ssdb
+from pydis_jam23.web import app, images
+
+from .common import RES_DIR, wikimedia_image  # noqa: F401 - import for fixtures
+
+
+def upload(image: Image.Image) -> tuple[FlaskClient, bytes]:
+    client = app.test_client()
+    file = io.BytesIO()
+    image.save(file, format="PNG")
+    client.post("/current_image", data={"image": (io.BytesIO(file.getvalue()), "image.png")})
+    return client, file.getvalue()
+
+
+def test_uploaded_image_served_as_is(wikimedia_image: Image.Image) -> None:
+    client, uploaded = upload(wikimedia_image)
+    response = client.get("/current_image")
+    assert response.data == uploaded
+    revalidated = client.get("/current_image", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+def test_encoded_image_changes_etag(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(wikimedia_image)
+    etag = client.get("/current_image").headers["ETag"]
+    client.post("/encode/lsb", data={"message": "Hello, world!", "bits": "1"})
+    response = client.get("/current_image", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert b"Hello, world!" in client.post("/decode/lsb", data={"bits": "1"}).data
+
+
+def test_api_roundtrip(wikimedia_image: Image.Image) -> None:
+    client = app.test_client()
+    file = io.BytesIO()
+    wikimedia_image.save(file, format="PNG")
+    encoded = client.post("/api/v1/encode/lsb?bits=2&message=Hello%2C+world!", data=file.getvalue())
+    assert encoded.mimetype == "image/png"
+    assert "Set-Cookie" not in encoded.headers
+    decoded = client.post("/api/v1/decode/lsb?bits=2", data=encoded.data)
+    assert decoded.data == b"Hello, world!"
+
+
+def test_api_binary_message(wikimedia_image: Image.Image) -> None:
+    client = app.test_client()
+    file = io.BytesIO()
+    wikimedia_image.save(file, format="PNG")
+    message = bytes(range(256))
+    encoded = client.post(
+        "/api/v1/encode/ssdb?password=secret&format=bmp",
+        data={"image": (io.BytesIO(file.getvalue()), "image.png"), "message": (io.BytesIO(message), "message")},
+    )
+    assert encoded.mimetype == "image/bmp"
+    decoded = client.post("/api/v1/decode/ssdb?password=secret", data=encoded.data)
+    assert decoded.data == message
+
+
+def test_api_file_codec_output_format(wikimedia_image: Image.Image) -> None:
+    client = app.test_client()
+    file = io.BytesIO()
+    wikimedia_image.save(file, format="PNG")
+    encoded = client.post("/api/v1/encode/concat?format=bmp&message=hi", data=file.getvalue())
+    assert encoded.mimetype == "image/bmp"
+    assert Image.open(io.BytesIO(encoded.data)).format == "BMP"
+    # in trailer mode the file is passed through as it is
+    trailer = client.post("/api/v1/encode/concat?format=bmp&trailer=true&message=hi", data=file.getvalue())
+    assert trailer.mimetype == "image/png"
+
+
+def test_api_errors() -> None:
+    client = app.test_client()
+    assert client.post("/api/v1/encode/unknown?message=hi", data=b"").status_code == 404
+    assert client.post("/api/v1/decode/lsb", data=b"not an image").status_code == 415
+    missing = client.post("/api/v1/decode/ssdb", data=b"")
+    assert missing.status_code == 400
+    assert "password" in missing.json["error"]
+
+
+def test_upload_decoded_when_needed(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(wikimedia_image)
+    with client.session_transaction() as session:
+        current = images.get(session["image_key"])
+    assert current is not None
+    assert current._pixels is None
+    # capacity only needs the header, other than for edges
+    for codec in ("lsb", "ssdb", "noise", "not", "concat"):
+        assert client.get(f"/capacity/{codec}").status_code == 200
+    assert current._pixels is None
+    client.post("/decode/lsb", data={"bits": "1"})
+    assert current.pixels.shape == (wikimedia_image.height, wikimedia_image.width, len(wikimedia_image.getbands()))
+
+
+def test_upload_limits(wikimedia_image: Image.Image, monkeypatch: pytest.MonkeyPatch) -> None:
+    file = io.BytesIO()
+    wikimedia_image.save(file, format="PNG")
+    client = app.test_client()
+    monkeypatch.setattr(web, "MAX_PIXELS", wikimedia_image.width * wikimedia_image.height - 1)
+    assert client.post("/current_image", data=file.getvalue()).status_code == 413
+    assert client.post("/api/v1/decode/lsb", data=file.getvalue()).status_code == 413
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", len(file.getvalue()) - 1)
+    assert client.post("/current_image", data=file.getvalue()).status_code == 413
+
+
+def test_preview_cached(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(wikimedia_image)
+    response = client.get("/current_image/preview?width=64&height=64", headers={"Accept": "image/webp,*/*"})
+    assert response.mimetype == "image/webp"
+    assert max(Image.open(io.BytesIO(response.data)).size) == 64
+    assert client.get("/current_image/preview?width=64&height=64&format=jpeg").mimetype == "image/jpeg"
+    revalidated = client.get(
+        "/current_image/preview?width=64&height=64",
+        headers={"Accept": "image/webp,*/*", "If-None-Match": response.headers["ETag"]},
+    )
+    assert revalidated.status_code == 304
+
+
+def test_capacity(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(wikimedia_image)
+    for legacy in (False, True):
+        response = client.get(f"/capacity/ssdb?legacy={str(legacy).lower()}")
+        assert response.json["capacity"] == ssdb.capacity(wikimedia_image, legacy=legacy)
+    response = client.get("/capacity/lsb?bits=2&length=100")
+    assert response.json == {"capacity": lsb.capacity(wikimedia_image, bits=2, msb=False), "fits": True, "lsb_bits": 1}
+    assert client.get("/capacity/lsb?bits=two").status_code == 400
+    assert client.get("/capacity/edges").json["capacity"] == edges.capacity(wikimedia_image)
+
+
+def test_concat_decode_draws_message(wikimedia_image: Image.Image) -> None:
+    client, _ = upload(concat.encode(wikimedia_image, b"Hello, world!"))
+    with client.session_transaction() as session:
+        key = session["image_key"]
+    encoded = images.get(key)
+    assert encoded is not None
+    page = client.post("/decode/concat", data={})
+    assert "Hello, world!" in page.text
+    drawn = images.get(key)
+    assert drawn is not None and drawn is not encoded
+    assert drawn.load().tobytes() != encoded.load().tobytes()
+
+
+def test_concat_trailer(wikimedia_image: Image.Image) -> None:
+    client, uploaded = upload(wikimedia_image)
+    client.post("/encode/concat", data={"message": "Hello, world!", "trailer": "on"})
+    encoded = client.get("/current_image").data
+    # the uploaded file is kept as it was, with the secret after it
+    assert encoded.startswith(uploaded)
+    assert encoded.endswith(concat.DataSect.end)
+    page = client.post("/decode/concat", data={"trailer": "on"})
+    assert "Hello, world!" in page.text
+    assert client.get("/current_image").data == encoded
+
+
+def test_notlsb_hides_uploaded_file() -> None:
+    client = app.test_client()
+    # a lossy file, which wouldn't come out the same if it were saved again
+    uploaded = (RES_DIR / "vista_de_cusco.webp").read_bytes()
+    client.post("/current_image", data=uploaded)
+    client.post("/encode/not", data={"message": "hello", "bits": "8"})
+    encoded = Image.open(io.BytesIO(client.get("/current_image").data))
+    assert lsb.decode(encoded, bits=8, msb=False) == uploaded